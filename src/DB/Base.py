@@ -5,24 +5,91 @@ from contextlib import contextmanager
 import os
 from typing import ClassVar
 
+from DB.slow_query_log import SlowQueryLog
+
 load_dotenv(find_dotenv())
 
+slow_query_log = SlowQueryLog(
+    threshold_ms=float(os.getenv("SLOW_QUERY_THRESHOLD_MS") or "500"),
+    explain_sample_rate=float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE_RATE") or "0.1"),
+    size=int(os.getenv("SLOW_QUERY_LOG_SIZE") or "100"),
+)
 
-class Base(SQLModel):
-    """Base class to perform session management for DB trasanctions"""
 
-    engine: ClassVar[Engine] = create_engine(
-        os.getenv("POSTGRES_CONNECTION_URL"),
+# every worker also holds one connection per DB outside of its pool, for the change listener (see DB.change_notifications)
+LISTENER_CONNECTIONS_PER_WORKER = 1
+
+
+def get_worker_count() -> int:
+    """number of server processes that will share the DB connection budget"""
+    return max(int(os.getenv("WEB_CONCURRENCY") or "1"), 1)
+
+
+def get_pool_size() -> int:
+    """
+    Size of the connection pool for a single worker, derived from the global connection budget
+
+    Every worker holds its own pool, so the budget is split evenly between them (less each worker's listener connection) and overflow is disabled to make sure the budget is never exceeded
+    """
+    budget = int(os.getenv("DB_CONNECTION_BUDGET") or "15")
+    return max(budget // get_worker_count() - LISTENER_CONNECTIONS_PER_WORKER, 1)
+
+
+def get_shard_urls() -> list[str]:
+    """
+    Connection URLs of every shard, in shard order
+
+    Without `SHARD_CONNECTION_URLS`, the only shard is the DB at `POSTGRES_CONNECTION_URL`
+    """
+    shard_urls = os.getenv("SHARD_CONNECTION_URLS")
+    if not shard_urls:
+        return [os.getenv("POSTGRES_CONNECTION_URL")]
+    return [url.strip() for url in shard_urls.split(",") if url.strip()]
+
+
+def build_engine(url: str) -> Engine:
+    engine = create_engine(
+        url,
         echo=os.getenv("IS_DEV_MODE") == "True",
+        pool_size=get_pool_size(),
+        max_overflow=0,
+        pool_pre_ping=True,
     )
+    slow_query_log.attach(engine)
+    return engine
+
+
+class Base(SQLModel):
+    """Base class to perform session management for DB trasanctions"""
+
+    # one engine per shard. `engine` is the first shard, which is the only one when the DB is not sharded
+    engines: ClassVar[list[Engine]] = [build_engine(url) for url in get_shard_urls()]
+    engine: ClassVar[Engine] = engines[0]
+    slow_query_log: ClassVar[SlowQueryLog] = slow_query_log
 
     @classmethod
     @contextmanager
-    def session_scope(cls):
-        """context manager to facilitate SQL transactions"""
-        session = Session(cls.engine)
+    def session_scope(cls, shard: int = 0):
+        """context manager to facilitate SQL transactions on a shard"""
+        session = Session(cls.engines[shard])
         try:
             yield session
 
         finally:
             session.close()
+
+    @classmethod
+    def reset_engine(cls) -> None:
+        """
+        Replace the engines after a fork, so that a worker never reuses connections pooled by its parent
+
+        `close=False` leaves the parent's connections untouched, since they are still in use by the parent process
+        """
+        for engine in Base.engines:
+            engine.dispose(close=False)
+        Base.engines = [build_engine(url) for url in get_shard_urls()]
+        Base.engine = Base.engines[0]
+
+
+# workers forked by a process manager (e.g. gunicorn) inherit the parent's engines, so give each child its own pools
+os.register_at_fork(after_in_child=Base.reset_engine)
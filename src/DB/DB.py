@@ -3,11 +3,24 @@ from sqlmodel import SQLModel
 
 from sqlalchemy.exc import OperationalError
 from DB.db_exceptions import DBConnectionError
+from DB.partitions import create_course_record_partitions, get_partition_year_range
+from DB.shards import reserve_shard_id_range, replicate_teachers
+from DB.change_feed import add_change_seq_column
 
 
 def init_db() -> None:
     try:
         SQLModel.metadata = Base.metadata
-        SQLModel.metadata.create_all(bind=Base.engine, checkfirst=True)
+        for engine in Base.engines:
+            SQLModel.metadata.create_all(bind=engine, checkfirst=True)
     except OperationalError as e:
         raise DBConnectionError("Could not connect to the DB")
+
+    # partitions for later years are created on demand when course records are uploaded
+    for shard in range(len(Base.engines)):
+        reserve_shard_id_range(shard)
+        add_change_seq_column(shard)
+        create_course_record_partitions(get_partition_year_range(), shard)
+
+    # teachers are only ever added to the first shard, so copy them to the others
+    replicate_teachers()
@@ -1,6 +1,10 @@
-from DB.student import Student, StudentDB
+from DB.student import Student, StudentDB, STUDENT_DATA_FIELDS
 from DB.teacher import Teacher
-from DB.course import Course_Record
+from DB.course import Course_Record, CourseRecordDB
 from DB.DB import init_db
+from DB.partitions import archive_course_record_partitions
+from DB.shards import ShardedStudentDB, ShardedCourseRecordDB
+from DB.change_notifications import ChangeListener, StudentChanges
+from DB.Base import Base
 
 from DB.db_exceptions import DBAPIError, DBConnectionError, DBRecordNotFoundError
@@ -0,0 +1,71 @@
+"""
+Change sequence for students, used for incremental syncs
+
+Every write to a student (or to their course records) stamps the student with the next value of `student_change_seq`, so that a client only has to ask for the students whose change_seq is greater than the last one it has seen
+Writers take a transaction level advisory lock before drawing from the sequence and hold it until they commit, so sequence values become visible in the order that they were drawn, and a reader can never see a change without the changes that came before it
+"""
+
+from DB.Base import Base
+from sqlalchemy import Sequence, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from DB.db_exceptions import DBAPIError
+
+student_change_seq = Sequence("student_change_seq", metadata=Base.metadata)
+
+# arbitrary key for pg_advisory_xact_lock, shared by every writer of change_seq
+CHANGE_SEQ_LOCK_KEY = 3_817_204
+
+lock_change_seq_sql = f"SELECT pg_advisory_xact_lock({CHANGE_SEQ_LOCK_KEY})"
+
+
+def stamp_students_in_table_sql(course_record_table: str) -> str:
+    """
+    Stamps every student with course records in `course_record_table` with a new change sequence
+
+    The lock and the update are sent as a single statement, so that they run in one transaction even on an autocommit connection
+    """
+    return f"""
+        {lock_change_seq_sql};
+        UPDATE student
+        SET change_seq = nextval('student_change_seq')
+        WHERE id IN (SELECT DISTINCT student_id FROM {course_record_table})
+    """
+
+
+def add_change_seq_column(shard: int = 0) -> None:
+    """
+    Add change_seq to a student table that was created before the change feed existed, stamping every existing student
+
+    Raises:
+        `DBAPIError`: If there was an issue with the DB request
+    """
+    try:
+        with Base.engines[shard].begin() as connection:
+            # checked first, since ALTER TABLE locks the table even when the column already exists
+            has_change_seq = connection.execute(text("""
+                    SELECT EXISTS (
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'student' AND column_name = 'change_seq'
+                    )
+                    """)).scalar()
+            if has_change_seq:
+                return
+
+            connection.execute(text("CREATE SEQUENCE IF NOT EXISTS student_change_seq"))
+            connection.execute(text("""
+                    ALTER TABLE student
+                    ADD COLUMN IF NOT EXISTS change_seq bigint NOT NULL DEFAULT nextval('student_change_seq')
+                    """))
+            connection.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_student_change_seq ON student (change_seq)"
+                )
+            )
+
+    except SQLAlchemyError as e:
+        raise DBAPIError(
+            message="There was an issue trying to add the change_seq column to student",
+            params=f"shard: {shard}",
+            original_error=str(e),
+        )
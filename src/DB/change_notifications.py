@@ -0,0 +1,181 @@
+"""
+Change notifications for student data, sent over Postgres LISTEN/NOTIFY
+
+Writes publish the ids of the students that changed, along with the terms (course record end dates) that changed, in the same transaction as the write. Postgres only delivers them once that transaction commits
+Every worker listens on every shard and invalidates only the cache entries that the change affects. Changes that affect every student (e.g. archiving course records) publish a single "clear all" message instead
+"""
+
+from DB.Base import Base
+from datetime import datetime
+from typing import Callable, Optional
+import json, logging, select, threading
+
+import psycopg2
+
+STUDENT_CHANGES_CHANNEL = "student_changes"
+
+# postgres rejects payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7000
+
+# tells listeners to drop everything they have cached
+CLEAR_ALL_PAYLOAD = json.dumps({"clear_all": True})
+
+# student id -> terms that changed, or None if the change affects every term (e.g. a new teacher)
+StudentChanges = dict[int, Optional[set[datetime]]]
+
+
+def build_change_payloads(changes: StudentChanges) -> list[str]:
+    """splits the changes into as few NOTIFY payloads as possible"""
+    payloads = []
+    entries = []
+    size = 0
+
+    for student_id, terms in changes.items():
+        entry = {
+            "student_id": student_id,
+            "terms": None if terms is None else sorted(t.isoformat() for t in terms),
+        }
+        entry_size = len(json.dumps(entry))
+
+        if entries and size + entry_size > MAX_PAYLOAD_BYTES:
+            payloads.append(json.dumps({"changes": entries}))
+            entries, size = [], 0
+
+        entries.append(entry)
+        size += entry_size + 2
+
+    if entries:
+        payloads.append(json.dumps({"changes": entries}))
+
+    return payloads
+
+
+def parse_change_payload(payload: str) -> StudentChanges:
+    return {
+        entry["student_id"]: (
+            None
+            if entry["terms"] is None
+            else {datetime.fromisoformat(term) for term in entry["terms"]}
+        )
+        for entry in json.loads(payload)["changes"]
+    }
+
+
+def notify_student_changes(
+    execute: Callable[[str, tuple], object], changes: StudentChanges
+) -> None:
+    """
+    Publish `changes` inside the caller's transaction
+
+    Args:
+        `execute`: runs a SQL statement with positional psycopg2 parameters on the caller's connection
+        `changes`: student ids and the terms that changed for them
+    """
+    for payload in build_change_payloads(changes):
+        execute("SELECT pg_notify(%s, %s)", (STUDENT_CHANGES_CHANNEL, payload))
+
+
+def notify_all_students_changed(execute: Callable[[str, tuple], object]) -> None:
+    """
+    Publish a change that affects every student inside the caller's transaction
+
+    Args:
+        `execute`: runs a SQL statement with positional psycopg2 parameters on the caller's connection
+    """
+    execute("SELECT pg_notify(%s, %s)", (STUDENT_CHANGES_CHANNEL, CLEAR_ALL_PAYLOAD))
+
+
+class ChangeListener:
+    """
+    Background threads (one per shard) that LISTEN for student changes and pass them to `on_change`
+
+    Each thread holds its own connection outside of the engine's pool. Notifications sent while a thread is disconnected are lost, so `on_reconnect` is called every time it (re)connects, to drop anything that may have gone stale. It is also called for changes that affect every student
+    """
+
+    def __init__(
+        self,
+        on_change: Callable[[StudentChanges], None],
+        on_reconnect: Callable[[], None],
+        poll_timeout_seconds: float = 5,
+        reconnect_delay_seconds: float = 5,
+    ):
+        self.on_change = on_change
+        self.on_reconnect = on_reconnect
+        self.poll_timeout_seconds = poll_timeout_seconds
+        self.reconnect_delay_seconds = reconnect_delay_seconds
+        self._stopped = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        self._stopped.clear()
+        self._threads = [
+            threading.Thread(
+                target=self._listen,
+                args=(shard,),
+                name=f"change-listener-{shard}",
+                daemon=True,
+            )
+            for shard in range(len(Base.engines))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(timeout=self.poll_timeout_seconds + 1)
+
+    def _listen(self, shard: int) -> None:
+        dsn = (
+            Base.engines[shard]
+            .url.set(drivername="postgresql")
+            .render_as_string(hide_password=False)
+        )
+
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = psycopg2.connect(dsn)
+                connection.autocommit = True
+                connection.cursor().execute(f"LISTEN {STUDENT_CHANGES_CHANNEL}")
+                self._run_callback(self.on_reconnect)
+
+                while not self._stopped.is_set():
+                    readable, _, _ = select.select(
+                        [connection], [], [], self.poll_timeout_seconds
+                    )
+                    if not readable:
+                        continue
+
+                    connection.poll()
+                    while connection.notifies:
+                        notification = connection.notifies.pop(0)
+                        self._handle(notification.payload)
+
+            except psycopg2.Error as e:
+                logging.warning(f"Change listener for shard {shard} disconnected | {e}")
+                self._stopped.wait(self.reconnect_delay_seconds)
+
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def _handle(self, payload: str) -> None:
+        if payload == CLEAR_ALL_PAYLOAD:
+            self._run_callback(self.on_reconnect)
+            return
+
+        try:
+            changes = parse_change_payload(payload)
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Invalid change notification | {payload} | {e}")
+            return
+
+        self._run_callback(self.on_change, changes)
+
+    def _run_callback(self, callback: Callable, *args) -> None:
+        """runs `on_change` or `on_reconnect`, logging any error so that it cannot stop the listener"""
+        try:
+            callback(*args)
+        except Exception:
+            logging.exception(f"Change listener callback {callback.__name__} failed")
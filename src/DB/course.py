@@ -1,11 +1,27 @@
 from DB.Base import Base
 from sqlmodel import Field, PrimaryKeyConstraint
+from sqlalchemy.exc import SQLAlchemyError
+from psycopg2 import Error as Psycopg2Error
 from typing import Optional
 from datetime import datetime
+import csv, io
+
+from DB.db_exceptions import DBAPIError
+from DB.partitions import (
+    create_course_record_partitions_for,
+    is_in_partition_year_range,
+    is_missing_partition_error,
+)
+from DB.change_notifications import notify_student_changes
+from DB.change_feed import lock_change_seq_sql
 
 
 class Course_Record(Base, table=True):
-    __table_args__ = (PrimaryKeyConstraint("student_id", "end_date"),)
+    # partitioned by academic year (see DB.partitions), which is why end_date has to be part of the primary key
+    __table_args__ = (
+        PrimaryKeyConstraint("student_id", "end_date"),
+        {"postgresql_partition_by": "RANGE (end_date)"},
+    )
 
     student_id: int = Field(foreign_key="student.id")
     end_date: datetime = Field(nullable=False)
@@ -13,3 +29,121 @@ class Course_Record(Base, table=True):
 
     def __repr__(self) -> str:
         return f"CourseRecord(student_id={self.student_id!r}, end_date={self.end_date!r}, grade={self.grade!r})"
+
+
+class CourseRecordDB:
+    # staging table only lives for the transaction of a single batch
+    create_staging_table_sql = """
+        CREATE TEMP TABLE course_record_staging (
+            ord serial,
+            student_id int,
+            end_date timestamp,
+            grade float
+        ) ON COMMIT DROP
+    """
+
+    copy_to_staging_sql = "COPY course_record_staging (student_id, end_date, grade) FROM STDIN WITH (FORMAT csv)"
+
+    # DISTINCT ON keeps only the last row uploaded for each key, since ON CONFLICT cannot update the same row twice in one statement
+    # joining on student drops rows for students that do not exist, instead of failing the whole batch on the foreign key
+    upsert_from_staging_sql = """
+        WITH upserted AS (
+            INSERT INTO course_record (student_id, end_date, grade)
+            SELECT DISTINCT ON (staging.student_id, staging.end_date)
+                staging.student_id, staging.end_date, staging.grade
+            FROM course_record_staging AS staging
+            JOIN student ON student.id = staging.student_id
+            ORDER BY staging.student_id, staging.end_date, staging.ord DESC
+            ON CONFLICT (student_id, end_date) DO UPDATE SET grade = EXCLUDED.grade
+            RETURNING (xmax = 0) AS is_insert
+        )
+        SELECT
+            count(*) FILTER (WHERE is_insert) AS inserted,
+            count(*) FILTER (WHERE NOT is_insert) AS updated
+        FROM upserted
+    """
+
+    # stamps every student in the batch with a new change sequence (see DB.change_feed)
+    stamp_changed_students_sql = """
+        UPDATE student
+        SET change_seq = nextval('student_change_seq')
+        WHERE id IN (SELECT DISTINCT student_id FROM course_record_staging)
+    """
+
+    def __init__(self, shard: int = 0):
+        self.shard = shard
+
+    def upsert_batch(
+        self, rows: list[tuple[int, datetime, Optional[float]]]
+    ) -> dict[str, int]:
+        """
+        Insert or update a batch of course records in a single transaction, by staging them through COPY and upserting on the (student_id, end_date) primary key
+
+        Args:
+            `rows`: (student_id, end_date, grade) tuples
+
+        Returns:
+            Number of rows that were inserted, updated and rejected. Rows are rejected when their student does not exist, when their end date falls outside the academic years that can be stored (see `get_partition_year_range`), or when a later row in the same batch has the same key
+
+        Raises:
+            `DBAPIError`: If there was an issue with the DB request
+        """
+        storable_rows = [row for row in rows if is_in_partition_year_range(row[1])]
+        out_of_range = len(rows) - len(storable_rows)
+        rows = storable_rows
+        if not rows:
+            return {"inserted": 0, "updated": 0, "rejected": out_of_range}
+
+        end_dates = {end_date for _, end_date, _ in rows}
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for student_id, end_date, grade in rows:
+            writer.writerow(
+                (student_id, end_date.isoformat(), "" if grade is None else grade)
+            )
+
+        for attempt in range(2):
+            # the second attempt checks every partition against the DB, in case another worker archived one
+            create_course_record_partitions_for(
+                end_dates, self.shard, refresh=attempt > 0
+            )
+            buffer.seek(0)
+
+            with Base.session_scope(self.shard) as session:
+                try:
+                    cursor = session.connection().connection.cursor()
+                    cursor.execute(self.create_staging_table_sql)
+                    cursor.copy_expert(self.copy_to_staging_sql, buffer)
+                    cursor.execute(self.upsert_from_staging_sql)
+                    inserted, updated = cursor.fetchone()
+
+                    # held until the commit, so that change sequences become visible in order
+                    cursor.execute(lock_change_seq_sql)
+                    cursor.execute(self.stamp_changed_students_sql)
+
+                    changed_terms = {}
+                    for student_id, end_date, _ in rows:
+                        changed_terms.setdefault(student_id, set()).add(end_date)
+                    notify_student_changes(cursor.execute, changed_terms)
+
+                    session.commit()
+                    break
+
+                except (SQLAlchemyError, Psycopg2Error) as e:
+                    session.rollback()
+                    if attempt == 0 and is_missing_partition_error(e):
+                        continue
+
+                    raise DBAPIError(
+                        message="There was an issue trying to upsert a batch of course records",
+                        sql_statement=self.upsert_from_staging_sql,
+                        params=f"{len(rows)} rows",
+                        original_error=str(e),
+                    )
+
+        return {
+            "inserted": inserted,
+            "updated": updated,
+            "rejected": len(rows) - inserted - updated + out_of_range,
+        }
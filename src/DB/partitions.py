@@ -0,0 +1,233 @@
+"""
+Management of the academic year partitions of course_record
+
+course_record is range partitioned on end_date, with one partition per academic year (Aug 1 to Aug 1 of the next year), so that date filtered queries only scan the years they need
+"""
+
+from DB.Base import Base
+from sqlalchemy import Connection, text
+from sqlalchemy.exc import SQLAlchemyError
+from datetime import datetime
+from typing import Iterable
+import logging, os, re, threading
+
+from DB.db_exceptions import DBAPIError
+from DB.change_notifications import notify_all_students_changed
+from DB.change_feed import stamp_students_in_table_sql
+
+# Sem 1 runs from Aug 1 to Nov 1, so an academic year starts on Aug 1
+ACADEMIC_YEAR_START_MONTH = 8
+ARCHIVE_SCHEMA = "archive"
+
+_partition_name_pattern = re.compile(r"^course_record_ay(\d{4})$")
+# partitions that are known to exist, for each shard. Other workers can archive partitions without this worker knowing, so a write that finds no partition refreshes it (see `is_missing_partition_error`)
+_known_partition_years: dict[int, set[int]] = {}
+_known_partition_years_lock = threading.Lock()
+
+
+def academic_year_of(date: datetime) -> int:
+    """the year in which the academic year that `date` falls in started"""
+    if date.month >= ACADEMIC_YEAR_START_MONTH:
+        return date.year
+    return date.year - 1
+
+
+def get_partition_year_range() -> range:
+    """
+    Academic years that course records can be stored for, from `COURSE_RECORD_FIRST_ACADEMIC_YEAR` up till next year
+
+    Partitions are never created outside of this range, so that a mistyped end date (e.g. 01-04-2204) cannot leave behind a partition that is never used
+    """
+    first_academic_year = int(os.getenv("COURSE_RECORD_FIRST_ACADEMIC_YEAR") or "2020")
+    return range(first_academic_year, academic_year_of(datetime.now()) + 2)
+
+
+def is_in_partition_year_range(date: datetime) -> bool:
+    return academic_year_of(date) in get_partition_year_range()
+
+
+def partition_name(academic_year: int) -> str:
+    return f"course_record_ay{academic_year}"
+
+
+def is_course_record_partitioned(connection: Connection) -> bool:
+    return connection.execute(
+        text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'course_record'::regclass)"
+        )
+    ).scalar()
+
+
+def list_partition_years(connection: Connection) -> set[int]:
+    """academic years that currently have a partition attached to course_record"""
+    partitions = connection.execute(text("""
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = 'course_record'::regclass
+            """)).scalars()
+
+    return {
+        int(match.group(1))
+        for match in map(_partition_name_pattern.match, partitions)
+        if match
+    }
+
+
+def is_missing_partition_error(error: Exception) -> bool:
+    """whether postgres rejected a row of course_record because no partition covers its end_date"""
+    error = getattr(error, "orig", error)
+    # check_violation, which postgres also raises for CHECK constraints
+    return getattr(error, "pgcode", None) == "23514" and "no partition" in str(error)
+
+
+def create_course_record_partitions(
+    academic_years: Iterable[int], shard: int = 0, refresh: bool = False
+) -> None:
+    """
+    Create the partitions for `academic_years` that do not exist yet
+
+    Args:
+        `academic_years`: the years in which the academic years start
+        `shard`: the shard to create the partitions on
+        `refresh`: ignore the partitions that this worker has seen before, and check every year against the DB
+
+    Raises:
+        `DBAPIError`: If there was an issue with the DB request
+    """
+    with _known_partition_years_lock:
+        if refresh:
+            _known_partition_years.pop(shard, None)
+        missing_years = sorted(
+            set(academic_years) - _known_partition_years.get(shard, set())
+        )
+    if not missing_years:
+        return
+
+    try:
+        with Base.engines[shard].begin() as connection:
+            if not is_course_record_partitioned(connection):
+                logging.warning(
+                    "course_record was created before it was partitioned, so no partitions will be created for it"
+                )
+                return
+
+            # serializes partition creation across workers, since CREATE TABLE IF NOT EXISTS can still race
+            connection.execute(
+                text(
+                    "SELECT pg_advisory_xact_lock(hashtext('course_record_partitions'))"
+                )
+            )
+            for year in missing_years:
+                connection.execute(text(f"""
+                        CREATE TABLE IF NOT EXISTS {partition_name(year)}
+                        PARTITION OF course_record
+                        FOR VALUES FROM ('{year}-{ACADEMIC_YEAR_START_MONTH:02d}-01') TO ('{year + 1}-{ACADEMIC_YEAR_START_MONTH:02d}-01')
+                        """))
+
+    except SQLAlchemyError as e:
+        raise DBAPIError(
+            message="There was an issue trying to create the course_record partitions",
+            params=str(missing_years),
+            original_error=str(e),
+        )
+
+    with _known_partition_years_lock:
+        _known_partition_years.setdefault(shard, set()).update(missing_years)
+
+
+def create_course_record_partitions_for(
+    dates: Iterable[datetime], shard: int = 0, refresh: bool = False
+) -> None:
+    """makes sure that every date in `dates` has a partition to go into, ignoring dates outside of `get_partition_year_range`"""
+    create_course_record_partitions(
+        {academic_year_of(date) for date in dates} & set(get_partition_year_range()),
+        shard,
+        refresh,
+    )
+
+
+def free_archive_name(connection: Connection, name: str) -> str:
+    """`name`, or `name` with the lowest numbered suffix that is not taken yet in the archive schema"""
+    archive_name, suffix = name, 1
+    while connection.execute(
+        text("SELECT to_regclass(:qualified_name) IS NOT NULL"),
+        {"qualified_name": f"{ARCHIVE_SCHEMA}.{archive_name}"},
+    ).scalar():
+        suffix += 1
+        archive_name = f"{name}_{suffix}"
+    return archive_name
+
+
+def archive_course_record_partitions(
+    before_academic_year: int, shard: int = 0
+) -> list[str]:
+    """
+    Detach every partition for academic years before `before_academic_year` and move it into the archive schema
+
+    Partitions are detached with DETACH PARTITION CONCURRENTLY, which does not block reads or writes to the other partitions. If a detach is interrupted, it has to be completed with DETACH PARTITION ... FINALIZE
+    Every student with course records in an archived partition is stamped with a new change sequence, so that incremental syncs pick up their new cumulative GPA
+    A partition that is re-created after its year was archived (e.g. by a late upload) is archived as course_record_ay<year>_2, _3 and so on
+
+    Args:
+        `before_academic_year`: partitions for academic years that start before this year are archived
+        `shard`: the shard to archive the partitions on
+
+    Returns:
+        The names of the partitions that were archived
+
+    Raises:
+        `DBAPIError`: If there was an issue with the DB request
+    """
+    archived = []
+    # a partition stops counting towards GPAs as soon as it is detached, even if moving it into the archive schema then fails
+    detached_any = False
+
+    try:
+        # DETACH PARTITION CONCURRENTLY cannot run inside a transaction block
+        with Base.engines[shard].connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as connection:
+            connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+
+            try:
+                for year in sorted(list_partition_years(connection)):
+                    if year >= before_academic_year:
+                        continue
+
+                    name = partition_name(year)
+                    connection.execute(
+                        text(
+                            f"ALTER TABLE course_record DETACH PARTITION {name} CONCURRENTLY"
+                        )
+                    )
+                    detached_any = True
+                    # the cumulative GPAs of these students no longer include the detached year, so the change feed reports them again
+                    connection.exec_driver_sql(stamp_students_in_table_sql(name))
+
+                    archive_name = free_archive_name(connection, name)
+                    if archive_name != name:
+                        connection.execute(
+                            text(f"ALTER TABLE {name} RENAME TO {archive_name}")
+                        )
+                    connection.execute(
+                        text(f"ALTER TABLE {archive_name} SET SCHEMA {ARCHIVE_SCHEMA}")
+                    )
+                    archived.append(archive_name)
+
+                    with _known_partition_years_lock:
+                        _known_partition_years.get(shard, set()).discard(year)
+
+            finally:
+                # the cumulative GPA of every student with records in a detached year has changed, so every worker drops its cached responses
+                if detached_any:
+                    notify_all_students_changed(connection.exec_driver_sql)
+
+    except SQLAlchemyError as e:
+        raise DBAPIError(
+            message="There was an issue trying to archive the course_record partitions",
+            params=f"archived so far: {archived}",
+            original_error=str(e),
+        )
+
+    return archived
@@ -0,0 +1,262 @@
+"""
+Horizontal sharding of students and their course records across several DBs
+
+Every shard owns a contiguous range of student ids: shard i owns ids i * SHARD_ID_RANGE_SIZE + 1 up till (i + 1) * SHARD_ID_RANGE_SIZE
+Teachers are a small reference table, so they are written to the first shard and copied to every other shard, which lets a student on any shard be assigned any teacher
+Reads over all students are scattered to every shard in parallel and gathered, while reads and writes for a single student are routed to the shard that owns them
+"""
+
+from DB.Base import Base
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Collection, Iterator, Optional
+import os
+
+from DB.student import StudentDB
+from DB.course import CourseRecordDB
+from DB.db_exceptions import DBAPIError, DBRecordNotFoundError
+from models import StudentDataResponse, ChangeTeacherResponse, StudentGpaHistoryResponse
+
+SHARD_ID_RANGE_SIZE = int(os.getenv("SHARD_ID_RANGE_SIZE") or "100000000")
+
+_shard_executor = ThreadPoolExecutor(
+    max_workers=4 * len(Base.engines), thread_name_prefix="shard"
+)
+
+
+def shard_for_id(id: int) -> int:
+    """the shard that owns a student or teacher id"""
+    return (id - 1) // SHARD_ID_RANGE_SIZE
+
+
+def reserve_shard_id_range(shard: int) -> None:
+    """
+    Move the student id sequence of a shard to the start of the range that it owns, so that ids never collide across shards
+
+    Raises:
+        `DBAPIError`: If there was an issue with the DB request
+    """
+    # the first shard's range starts where the sequence already starts
+    if shard == 0:
+        return
+
+    range_start = shard * SHARD_ID_RANGE_SIZE
+    try:
+        with Base.engines[shard].begin() as connection:
+            connection.execute(
+                text("""
+                    SELECT setval(
+                        pg_get_serial_sequence('student', 'id'),
+                        GREATEST((SELECT COALESCE(MAX(id), 0) FROM student), :range_start)
+                    )
+                    """),
+                {"range_start": range_start},
+            )
+
+    except SQLAlchemyError as e:
+        raise DBAPIError(
+            message="There was an issue trying to reserve the id range of a shard",
+            params=f"shard: {shard}, range start: {range_start}",
+            original_error=str(e),
+        )
+
+
+def replicate_teachers() -> None:
+    """
+    Copy every teacher from the first shard to the other shards, inserting new teachers and updating the names of existing ones
+
+    Raises:
+        `DBAPIError`: If there was an issue with the DB request
+    """
+    if len(Base.engines) == 1:
+        return
+
+    shard = 0
+    try:
+        with Base.engines[0].connect() as connection:
+            teachers = [
+                dict(teacher._mapping)
+                for teacher in connection.execute(text("SELECT id, name FROM teacher"))
+            ]
+        if not teachers:
+            return
+
+        for shard in range(1, len(Base.engines)):
+            with Base.engines[shard].begin() as connection:
+                connection.execute(
+                    text("""
+                        INSERT INTO teacher (id, name) VALUES (:id, :name)
+                        ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name
+                        """),
+                    teachers,
+                )
+
+    except SQLAlchemyError as e:
+        raise DBAPIError(
+            message="There was an issue trying to copy the teachers to every shard",
+            params=f"shard: {shard}",
+            original_error=str(e),
+        )
+
+
+class ShardedStudentDB:
+    """Routes `StudentDB` calls to the shards that hold the requested students"""
+
+    def __init__(self):
+        self.shards = [StudentDB(shard) for shard in range(len(Base.engines))]
+
+    def shard_of_student(self, student_id: int) -> StudentDB:
+        """
+        Raises:
+            `DBRecordNotFoundError`: if no shard owns the student id
+        """
+        shard = shard_for_id(student_id)
+        if student_id < 1 or shard >= len(self.shards):
+            raise DBRecordNotFoundError(
+                message="The requested student cannot be found on any shard",
+                params=f"student_id: {student_id}",
+            )
+        return self.shards[shard]
+
+    def _scatter_gather(self, method_name: str, *args) -> list:
+        """runs the same StudentDB method on every shard in parallel, concatenating the results"""
+        if len(self.shards) == 1:
+            return getattr(self.shards[0], method_name)(*args)
+
+        futures = [
+            _shard_executor.submit(getattr(shard, method_name), *args)
+            for shard in self.shards
+        ]
+
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
+    def get_all_cumulative_gpa_and_teacher_name(self) -> list[StudentDataResponse]:
+        return self._scatter_gather("get_all_cumulative_gpa_and_teacher_name")
+
+    def get_all_cumulative_gpa_and_teacher_name_after(
+        self, start_date: datetime
+    ) -> list[StudentDataResponse]:
+        return self._scatter_gather(
+            "get_all_cumulative_gpa_and_teacher_name_after", start_date
+        )
+
+    def get_all_cumulative_gpa_and_teacher_name_before(
+        self, end_date: datetime
+    ) -> list[StudentDataResponse]:
+        return self._scatter_gather(
+            "get_all_cumulative_gpa_and_teacher_name_before", end_date
+        )
+
+    def get_all_cumulative_gpa_and_teacher_name_between(
+        self, start_date: datetime, end_date: datetime
+    ) -> list[StudentDataResponse]:
+        return self._scatter_gather(
+            "get_all_cumulative_gpa_and_teacher_name_between", start_date, end_date
+        )
+
+    def get_cumulative_gpa_and_teacher_name_fields(
+        self,
+        fields: Collection[str],
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+    ) -> list[dict]:
+        return self._scatter_gather(
+            "get_cumulative_gpa_and_teacher_name_fields", fields, start_date, end_date
+        )
+
+    def get_cumulative_gpa_for_windows(
+        self, windows: list[tuple[Optional[datetime], Optional[datetime]]]
+    ) -> list[dict]:
+        return self._scatter_gather("get_cumulative_gpa_for_windows", windows)
+
+    def get_changes_since(
+        self, since: list[int], limit: int = 1000
+    ) -> tuple[list[dict], list[int], bool]:
+        """
+        Every shard has its own change sequence, so `since` holds the latest change sequence seen on each shard, in shard order
+
+        Returns:
+            The changed students from every shard (at most `limit` per shard), the latest change sequence of each shard, and whether any shard may have more changes
+        """
+        futures = [
+            _shard_executor.submit(shard.get_changes_since, shard_since, limit)
+            for shard, shard_since in zip(self.shards, since)
+        ]
+
+        changes, latest_seqs, has_more = [], [], False
+        for future in futures:
+            shard_changes, latest_seq = future.result()
+            changes.extend(shard_changes)
+            latest_seqs.append(latest_seq)
+            has_more = has_more or len(shard_changes) >= limit
+        return changes, latest_seqs, has_more
+
+    def stream_cumulative_gpa_and_teacher_name(
+        self,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        chunk_size: int = 1000,
+    ) -> Iterator[list[dict]]:
+        # shards own ascending id ranges, so reading them one after another keeps the stream ordered by student id
+        for shard in self.shards:
+            yield from shard.stream_cumulative_gpa_and_teacher_name(
+                start_date, end_date, chunk_size
+            )
+
+    def get_student_gpa_history(
+        self,
+        student_id: int,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+    ) -> StudentGpaHistoryResponse:
+        return self.shard_of_student(student_id).get_student_gpa_history(
+            student_id, start_date, end_date
+        )
+
+    def change_teacher(self, student_id: int, teacher_id: int) -> ChangeTeacherResponse:
+        # every shard has a copy of every teacher, so only the student decides the shard
+        return self.shard_of_student(student_id).change_teacher(student_id, teacher_id)
+
+
+class ShardedCourseRecordDB:
+    """Splits batches of course records between the shards that own their students"""
+
+    def __init__(self):
+        self.shards = [CourseRecordDB(shard) for shard in range(len(Base.engines))]
+
+    def upsert_batch(
+        self, rows: list[tuple[int, datetime, Optional[float]]]
+    ) -> dict[str, int]:
+        """
+        Upsert every shard's part of the batch in parallel
+
+        Returns:
+            Number of rows that were inserted, updated and rejected across all shards. Rows for student ids that no shard owns are rejected
+
+        Raises:
+            `DBAPIError`: If there was an issue with the DB request on any shard
+        """
+        counts = {"inserted": 0, "updated": 0, "rejected": 0}
+
+        rows_by_shard = {}
+        for row in rows:
+            shard = shard_for_id(row[0])
+            if row[0] < 1 or shard >= len(self.shards):
+                counts["rejected"] += 1
+                continue
+            rows_by_shard.setdefault(shard, []).append(row)
+
+        futures = [
+            _shard_executor.submit(self.shards[shard].upsert_batch, shard_rows)
+            for shard, shard_rows in rows_by_shard.items()
+        ]
+        for future in futures:
+            for key, value in future.result().items():
+                counts[key] += value
+
+        return counts
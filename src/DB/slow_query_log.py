@@ -0,0 +1,101 @@
+from sqlalchemy import Engine, event
+from collections import deque
+from datetime import datetime, timezone
+import logging, random, threading, time
+
+
+class SlowQueryLog:
+    """
+    Logs every statement on an engine that takes longer than `threshold_ms`, and keeps the most recent ones in a bounded ring buffer
+
+    For a sampled fraction of slow statements, the query plan is captured as well. Plain SELECTs are re-run with EXPLAIN (ANALYZE, BUFFERS) to get actual timings, while other statements (including WITH, which can hold data-modifying CTEs) only get EXPLAIN. The EXPLAIN is always rolled back, so that nothing it ran is kept
+    """
+
+    def __init__(
+        self,
+        threshold_ms: float = 500,
+        explain_sample_rate: float = 0.1,
+        size: int = 100,
+    ):
+        self.threshold_ms = threshold_ms
+        self.explain_sample_rate = explain_sample_rate
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def attach(self, engine: Engine) -> None:
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    @property
+    def entries(self) -> list[dict]:
+        """slow statements, most recent first"""
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _before_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        # kept on the execution context, so that a statement that fails leaves nothing behind on the pooled connection
+        context._slow_query_start_time = time.perf_counter()
+
+    def _after_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        duration_ms = (time.perf_counter() - context._slow_query_start_time) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+
+        row_count = cursor.rowcount
+        logging.warning(
+            f"Slow query | {duration_ms:.1f}ms | {row_count} rows | {statement} | {parameters}"
+        )
+
+        plan = None
+        if not executemany and random.random() < self.explain_sample_rate:
+            plan = self._explain(conn, statement, parameters)
+
+        with self._lock:
+            self._entries.append(
+                {
+                    "logged_at": datetime.now(timezone.utc),
+                    "statement": statement,
+                    "params": repr(parameters),
+                    "duration_ms": duration_ms,
+                    "row_count": row_count,
+                    "plan": plan,
+                }
+            )
+
+    def _explain(self, conn, statement: str, parameters) -> list[str]:
+        """captures the plan of the statement on the same connection, so that it runs with the same settings and transaction"""
+        is_select = statement.lstrip().upper().startswith("SELECT")
+        explain = "EXPLAIN (ANALYZE, BUFFERS) " if is_select else "EXPLAIN "
+
+        # the savepoint is always rolled back, so that a failed EXPLAIN cannot abort the statement's transaction, and anything EXPLAIN ANALYZE ran (e.g. volatile functions in a SELECT) is undone
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.execute("SAVEPOINT slow_query_explain")
+            try:
+                cursor.execute(explain + statement, parameters)
+                return [
+                    " ".join(str(column) for column in row) for row in cursor.fetchall()
+                ]
+
+            except Exception as e:
+                logging.info(f"Could not capture query plan | {statement} | {e}")
+                return None
+
+            finally:
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+
+        except Exception as e:
+            logging.info(f"Could not capture query plan | {statement} | {e}")
+            return None
+
+        finally:
+            cursor.close()
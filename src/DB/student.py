@@ -2,30 +2,47 @@ from DB.Base import Base
 from sqlmodel import Field, select, update
 
 # choice of type import: https://docs.sqlalchemy.org/en/20/core/type_basics.html
-from sqlalchemy import func, FLOAT, and_
+from sqlalchemy import func, FLOAT, and_, or_, BigInteger, Column, text
 from sqlalchemy.sql import Values, column
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import SQLAlchemyError, NoResultFound, IntegrityError
 from DB.course import Course_Record
 from DB.teacher import Teacher
 from DB.db_exceptions import DBAPIError, DBRecordNotFoundError
+from DB.change_notifications import notify_student_changes
+from DB.change_feed import student_change_seq, lock_change_seq_sql
 from datetime import datetime
+from typing import Collection, Iterator, Optional
 
-from models import StudentDataResponse, ChangeTeacherResponse
+from models import StudentDataResponse, ChangeTeacherResponse, StudentGpaHistoryResponse
 from data import gpa_mapping
 
+# every column that the student data queries can select
+STUDENT_DATA_FIELDS = ("student_id", "student_name", "teacher_name", "cumulative_gpa")
+
 
 class Student(Base, table=True):
     id: int = Field(primary_key=True)
     name: str = Field(nullable=False)
     teacher_id: int = Field(foreign_key="teacher.id")
+    # bumped on every write to the student or their course records (see DB.change_feed)
+    change_seq: Optional[int] = Field(
+        default=None,
+        sa_column=Column(
+            BigInteger,
+            server_default=student_change_seq.next_value(),
+            nullable=False,
+            index=True,
+        ),
+    )
 
     def __repr__(self) -> str:
         return f"Student(id={self.id!r}, name={self.name!r}, teacher_id={self.teacher_id!r})"
 
 
 class StudentDB:
-    def __init__(self):
+    def __init__(self, shard: int = 0):
+        self.shard = shard
         self.gpa_conversion_scale = Values(
             column("lower_bound", FLOAT),
             column("upper_bound", FLOAT),
@@ -84,7 +101,7 @@ class StudentDB:
             )
         )
 
-        with Base.session_scope() as session:
+        with Base.session_scope(self.shard) as session:
             try:
                 scores = session.exec(query)
                 return [dict(score._mapping) for score in scores]
@@ -111,11 +128,13 @@ class StudentDB:
             `DBRecordNotFoundError`: requested resource does not exist on the DB
             `DBAPIError`: if there was any other issue with the DB request
         """
-        with Base.session_scope() as session:
+        with Base.session_scope(self.shard) as session:
             update_student_query = (
                 update(Student)
                 .where(Student.id == student_id)
-                .values(teacher_id=teacher_id)
+                .values(
+                    teacher_id=teacher_id, change_seq=student_change_seq.next_value()
+                )
             )
 
             update_student_query_sql = update_student_query.compile(
@@ -123,8 +142,14 @@ class StudentDB:
             )
 
             try:
-
+                # held until the commit, so that change sequences become visible in order
+                session.exec(text(lock_change_seq_sql))
                 update_result = session.exec(update_student_query)
+                if update_result.rowcount > 0:
+                    # other workers drop their cached data for this student once the update commits
+                    notify_student_changes(
+                        session.connection().exec_driver_sql, {student_id: None}
+                    )
                 session.commit()
 
                 # raise an error if the requested student cannot be found
@@ -239,7 +264,7 @@ class StudentDB:
             )
         )
 
-        with Base.session_scope() as session:
+        with Base.session_scope(self.shard) as session:
             try:
                 scores = session.exec(query)
                 return [dict(score._mapping) for score in scores]
@@ -304,7 +329,7 @@ class StudentDB:
             )
         )
 
-        with Base.session_scope() as session:
+        with Base.session_scope(self.shard) as session:
             try:
                 scores = session.exec(query)
                 return [dict(score._mapping) for score in scores]
@@ -375,7 +400,7 @@ class StudentDB:
             )
         )
 
-        with Base.session_scope() as session:
+        with Base.session_scope(self.shard) as session:
             try:
                 scores = session.exec(query)
                 return [dict(score._mapping) for score in scores]
@@ -386,3 +411,446 @@ class StudentDB:
                     sql_statement=str(query.compile(dialect=postgresql.dialect())),
                     original_error=str(e),
                 )
+
+    def _cumulative_gpa_query(
+        self,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        fields: Optional[Collection[str]] = None,
+    ):
+        """
+        Builds the query for each student's id, name, cumulative GPA and teacher name, only considering course records that ended between `start_date` and `end_date` (when they are provided)
+
+        When `fields` is provided, only those columns are selected, and the join on teacher is skipped unless `teacher_name` is one of them
+        """
+        if fields is None:
+            fields = STUDENT_DATA_FIELDS
+
+        score_to_gpa_query = (
+            select(
+                Student.id.label("student_id"),
+                Student.name.label("student_name"),
+                self.gpa_conversion_scale.c.gpa.label("gpa"),
+                Course_Record.grade.label("grade"),
+                Student.teacher_id.label("student_teacher_id"),
+            )
+            .join(Student, Student.id == Course_Record.student_id)
+            .join(
+                self.gpa_conversion_scale,
+                and_(
+                    Course_Record.grade >= self.gpa_conversion_scale.c.lower_bound,
+                    Course_Record.grade <= self.gpa_conversion_scale.c.upper_bound,
+                ),
+            )
+        )
+
+        if start_date:
+            score_to_gpa_query = score_to_gpa_query.where(
+                Course_Record.end_date >= start_date
+            )
+
+        if end_date:
+            score_to_gpa_query = score_to_gpa_query.where(
+                Course_Record.end_date <= end_date
+            )
+
+        score_to_gpa_query = score_to_gpa_query.subquery()
+
+        columns = []
+        group_by = [score_to_gpa_query.c.student_id]
+
+        if "student_id" in fields:
+            columns.append(score_to_gpa_query.c.student_id.label("student_id"))
+
+        if "student_name" in fields:
+            columns.append(score_to_gpa_query.c.student_name.label("student_name"))
+            group_by.append(score_to_gpa_query.c.student_name)
+
+        if "teacher_name" in fields:
+            columns.append(Teacher.name.label("teacher_name"))
+            group_by.append(Teacher.name)
+
+        if "cumulative_gpa" in fields:
+            columns.append(func.avg(score_to_gpa_query.c.gpa).label("cumulative_gpa"))
+
+        query = select(*columns).select_from(score_to_gpa_query)
+        if "teacher_name" in fields:
+            query = query.join(
+                Teacher, score_to_gpa_query.c.student_teacher_id == Teacher.id
+            )
+
+        return query.group_by(*group_by).order_by(score_to_gpa_query.c.student_id)
+
+    def get_cumulative_gpa_and_teacher_name_fields(
+        self,
+        fields: Collection[str],
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+    ) -> list[dict]:
+        """
+        For each student in the DB, get only the requested `fields` out of their id, name, cumulative GPA and teacher name
+
+        Args:
+            `fields`: the columns to select, out of `STUDENT_DATA_FIELDS`
+            `start_date`: the earliest date from which you want to start considering student scores
+            `end_date`: the latest date from which you want to start considering student scores
+
+        Returns:
+            A list of student data, with only the requested fields
+
+        Raises:
+            `DBAPIError`: If there was an issue with the DB request
+        """
+        query = self._cumulative_gpa_query(start_date, end_date, fields)
+
+        with Base.session_scope(self.shard) as session:
+            try:
+                scores = session.exec(query)
+                return [dict(score._mapping) for score in scores]
+
+            except SQLAlchemyError as e:
+                compiled_query = query.compile(dialect=postgresql.dialect())
+                raise DBAPIError(
+                    message="There was an issue trying to get the requested fields of the student data for each student",
+                    sql_statement=str(compiled_query),
+                    params=compiled_query.params,
+                    original_error=str(e),
+                )
+
+    def get_cumulative_gpa_for_windows(
+        self, windows: list[tuple[Optional[datetime], Optional[datetime]]]
+    ) -> list[dict]:
+        """
+        For each student in the DB, get their name, teacher name and cumulative GPA within each of the date windows, in a single scan of course_record
+
+        Every window's GPA is computed with a conditional aggregate (AVG(...) FILTER (WHERE ...)), and the scan is limited to the range that covers all of the windows
+
+        NOTE: This will exclude students who dont have a course record in any of the windows
+
+        Args:
+            `windows`: (start_date, end_date) pairs, where None means that the window is unbounded on that side
+
+        Returns:
+            A list of student data, where `window_gpas` holds the cumulative GPA of each window in the same order as `windows` (None if the student has no course records in that window)
+
+        Raises:
+            `DBAPIError`: If there was an issue with the DB request
+        """
+        score_to_gpa_query = (
+            select(
+                Student.id.label("student_id"),
+                Student.name.label("student_name"),
+                self.gpa_conversion_scale.c.gpa.label("gpa"),
+                Course_Record.end_date.label("end_date"),
+                Student.teacher_id.label("student_teacher_id"),
+            )
+            .join(Student, Student.id == Course_Record.student_id)
+            .join(
+                self.gpa_conversion_scale,
+                and_(
+                    Course_Record.grade >= self.gpa_conversion_scale.c.lower_bound,
+                    Course_Record.grade <= self.gpa_conversion_scale.c.upper_bound,
+                ),
+            )
+        )
+
+        # only scan the course records that fall in at least one window
+        start_dates = [start_date for start_date, _ in windows]
+        end_dates = [end_date for _, end_date in windows]
+        if None not in start_dates:
+            score_to_gpa_query = score_to_gpa_query.where(
+                Course_Record.end_date >= min(start_dates)
+            )
+        if None not in end_dates:
+            score_to_gpa_query = score_to_gpa_query.where(
+                Course_Record.end_date <= max(end_dates)
+            )
+
+        # and skip the records that fall in the gaps between disjoint windows, so that students with no records in any window are left out
+        window_conditions = []
+        for start_date, end_date in windows:
+            conditions = []
+            if start_date:
+                conditions.append(Course_Record.end_date >= start_date)
+            if end_date:
+                conditions.append(Course_Record.end_date <= end_date)
+            window_conditions.append(and_(*conditions) if conditions else None)
+        if all(condition is not None for condition in window_conditions):
+            score_to_gpa_query = score_to_gpa_query.where(or_(*window_conditions))
+
+        score_to_gpa_query = score_to_gpa_query.subquery()
+
+        window_columns = []
+        for index, (start_date, end_date) in enumerate(windows):
+            conditions = []
+            if start_date:
+                conditions.append(score_to_gpa_query.c.end_date >= start_date)
+            if end_date:
+                conditions.append(score_to_gpa_query.c.end_date <= end_date)
+
+            window_gpa = func.avg(score_to_gpa_query.c.gpa)
+            if conditions:
+                window_gpa = window_gpa.filter(and_(*conditions))
+            window_columns.append(window_gpa.label(f"window_{index}"))
+
+        query = (
+            select(
+                score_to_gpa_query.c.student_id.label("student_id"),
+                score_to_gpa_query.c.student_name.label("student_name"),
+                Teacher.name.label("teacher_name"),
+                *window_columns,
+            )
+            .join(Teacher, score_to_gpa_query.c.student_teacher_id == Teacher.id)
+            .group_by(
+                score_to_gpa_query.c.student_id,
+                score_to_gpa_query.c.student_name,
+                Teacher.name,
+            )
+            .order_by(score_to_gpa_query.c.student_id)
+        )
+
+        with Base.session_scope(self.shard) as session:
+            try:
+                scores = session.exec(query)
+                return [
+                    {
+                        "student_id": score.student_id,
+                        "student_name": score.student_name,
+                        "teacher_name": score.teacher_name,
+                        "window_gpas": [
+                            score._mapping[f"window_{index}"]
+                            for index in range(len(windows))
+                        ],
+                    }
+                    for score in scores
+                ]
+
+            except SQLAlchemyError as e:
+                compiled_query = query.compile(dialect=postgresql.dialect())
+                raise DBAPIError(
+                    message="There was an issue trying to calculate the cumulative GPA of each window for each student",
+                    sql_statement=str(compiled_query),
+                    params=compiled_query.params,
+                    original_error=str(e),
+                )
+
+    def get_changes_since(
+        self, since: int, limit: int = 1000
+    ) -> tuple[list[dict], int]:
+        """
+        Get the students that changed after the change sequence `since`, in the order that they changed, along with their:
+          (a) name
+          (b) teacher id and name
+          (c) cumulative GPA
+          (d) change sequence
+
+        Students are found through the index on change_seq, and GPAs are only calculated for the students that changed, so this costs O(changes) rather than O(students)
+
+        Args:
+            `since`: the latest change sequence that the caller has already seen
+            `limit`: the maximum number of students to return
+
+        Returns:
+            The changed students, and the latest change sequence among them (or `since` if nothing changed)
+
+        Raises:
+            `DBAPIError`: If there was an issue with the DB request
+        """
+        changed_students = (
+            select(
+                Student.id.label("student_id"),
+                Student.name.label("student_name"),
+                Student.teacher_id.label("teacher_id"),
+                Student.change_seq.label("change_seq"),
+            )
+            .where(Student.change_seq > since)
+            .order_by(Student.change_seq)
+            .limit(limit)
+            .subquery()
+        )
+
+        cumulative_gpas = (
+            select(
+                Course_Record.student_id.label("student_id"),
+                func.avg(self.gpa_conversion_scale.c.gpa).label("cumulative_gpa"),
+            )
+            .join(
+                self.gpa_conversion_scale,
+                and_(
+                    Course_Record.grade >= self.gpa_conversion_scale.c.lower_bound,
+                    Course_Record.grade <= self.gpa_conversion_scale.c.upper_bound,
+                ),
+            )
+            .where(Course_Record.student_id.in_(select(changed_students.c.student_id)))
+            .group_by(Course_Record.student_id)
+            .subquery()
+        )
+
+        query = (
+            select(
+                changed_students.c.student_id,
+                changed_students.c.student_name,
+                changed_students.c.teacher_id,
+                Teacher.name.label("teacher_name"),
+                cumulative_gpas.c.cumulative_gpa,
+                changed_students.c.change_seq,
+            )
+            .join(Teacher, Teacher.id == changed_students.c.teacher_id)
+            .outerjoin(
+                cumulative_gpas,
+                cumulative_gpas.c.student_id == changed_students.c.student_id,
+            )
+            .order_by(changed_students.c.change_seq)
+        )
+
+        with Base.session_scope(self.shard) as session:
+            try:
+                changes = [dict(change._mapping) for change in session.exec(query)]
+
+            except SQLAlchemyError as e:
+                compiled_query = query.compile(dialect=postgresql.dialect())
+                raise DBAPIError(
+                    message="There was an issue trying to get the students that changed",
+                    sql_statement=str(compiled_query),
+                    params=compiled_query.params,
+                    original_error=str(e),
+                )
+
+        latest_seq = changes[-1]["change_seq"] if changes else since
+        return changes, latest_seq
+
+    def stream_cumulative_gpa_and_teacher_name(
+        self,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        chunk_size: int = 1000,
+    ) -> Iterator[list[dict]]:
+        """
+        For each student in the DB, stream their id, name, cumulative GPA and teacher name, in chunks of at most `chunk_size` students
+
+        Rows are read through a server-side cursor, so memory usage stays constant no matter how many students there are
+
+        Args:
+            `start_date`: the earliest date from which you want to start considering student scores
+            `end_date`: the latest date from which you want to start considering student scores
+            `chunk_size`: number of rows fetched from the DB at a time
+
+        Returns:
+            An iterator of lists of student data
+
+        Raises:
+            `DBAPIError`: If there was an issue with the DB request
+        """
+        query = self._cumulative_gpa_query(start_date, end_date)
+
+        with Base.session_scope(self.shard) as session:
+            try:
+                scores = session.exec(query.execution_options(yield_per=chunk_size))
+                for chunk in scores.partitions():
+                    yield [dict(score._mapping) for score in chunk]
+
+            except SQLAlchemyError as e:
+                compiled_query = query.compile(dialect=postgresql.dialect())
+                raise DBAPIError(
+                    message="There was an issue trying to stream the cumulative GPA and teacher name for each student",
+                    sql_statement=str(compiled_query),
+                    params=compiled_query.params,
+                    original_error=str(e),
+                )
+
+    def get_student_gpa_history(
+        self,
+        student_id: int,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+    ) -> StudentGpaHistoryResponse:
+        """
+        Get a single student's:
+          (a) name
+          (b) teacher name
+          (c) cumulative GPA
+          (d) GPA for each term, along with the running cumulative GPA up till that term
+
+        Course records are filtered on the (student_id, end_date) primary key, so this only reads the records of the requested student
+
+        Args:
+            `student_id`: DB ID of student
+            `start_date`: the earliest date from which you want to start considering student scores
+            `end_date`: the latest date from which you want to start considering student scores
+
+        Returns:
+            `StudentGpaHistoryResponse`
+
+        Raises:
+            `DBRecordNotFoundError`: the requested student does not exist
+            `DBAPIError`: If there was any other issue with the DB request
+        """
+        student_query = (
+            select(
+                Student.id.label("student_id"),
+                Student.name.label("student_name"),
+                Teacher.name.label("teacher_name"),
+            )
+            .join(Teacher, Teacher.id == Student.teacher_id)
+            .where(Student.id == student_id)
+        )
+
+        gpa_history_query = (
+            select(
+                Course_Record.end_date.label("end_date"),
+                self.gpa_conversion_scale.c.gpa.label("gpa"),
+                func.avg(self.gpa_conversion_scale.c.gpa)
+                .over(order_by=Course_Record.end_date)
+                .label("cumulative_gpa"),
+            )
+            .join(
+                self.gpa_conversion_scale,
+                and_(
+                    Course_Record.grade >= self.gpa_conversion_scale.c.lower_bound,
+                    Course_Record.grade <= self.gpa_conversion_scale.c.upper_bound,
+                ),
+            )
+            .where(Course_Record.student_id == student_id)
+            .order_by(Course_Record.end_date)
+        )
+
+        if start_date:
+            gpa_history_query = gpa_history_query.where(
+                Course_Record.end_date >= start_date
+            )
+
+        if end_date:
+            gpa_history_query = gpa_history_query.where(
+                Course_Record.end_date <= end_date
+            )
+
+        with Base.session_scope(self.shard) as session:
+            try:
+                student = dict(session.exec(student_query).one()._mapping)
+                gpa_history = [
+                    dict(term._mapping) for term in session.exec(gpa_history_query)
+                ]
+
+            except NoResultFound as e:
+                compiled_query = student_query.compile(dialect=postgresql.dialect())
+                raise DBRecordNotFoundError(
+                    message="The requested student cannot be found",
+                    sql_statement=str(compiled_query),
+                    params=compiled_query.params,
+                    original_error=str(e),
+                )
+
+            except SQLAlchemyError as e:
+                compiled_query = gpa_history_query.compile(dialect=postgresql.dialect())
+                raise DBAPIError(
+                    message="There was an issue trying to get the GPA history of the student",
+                    sql_statement=str(compiled_query),
+                    params=compiled_query.params,
+                    original_error=str(e),
+                )
+
+        student["gpa_history"] = gpa_history
+        student["cumulative_gpa"] = (
+            gpa_history[-1]["cumulative_gpa"] if gpa_history else None
+        )
+        return student
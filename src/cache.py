@@ -0,0 +1,164 @@
+"""
+In-process caches for responses that are filtered by a (start_date, end_date) window
+
+Writes invalidate only the entries whose window covers the terms that were changed, and per-student entries are grouped by student id, so that a write to one student only invalidates that student's entries
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Hashable, Iterable, Optional
+
+MISSING = object()
+
+DateWindow = tuple[Optional[datetime], Optional[datetime]]
+
+
+def window_covers_any(window: DateWindow, terms: Optional[Iterable[datetime]]) -> bool:
+    """
+    Whether any of the terms (course record end dates) fall in the window. None for `terms` means that every term could have changed
+    """
+    if terms is None:
+        return True
+
+    start_date, end_date = window
+    return any(
+        (start_date is None or term >= start_date)
+        and (end_date is None or term <= end_date)
+        for term in terms
+    )
+
+
+class StudentCache:
+    """TTL cache with least-recently-used eviction of whole students once `max_students` is reached"""
+
+    def __init__(self, ttl_seconds: float = 60, max_students: int = 10_000):
+        self.ttl_seconds = ttl_seconds
+        self.max_students = max_students
+        # bumped on every invalidation, so that values computed before an invalidation are not cached after it
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, dict[Hashable, tuple[float, Any]]] = (
+            OrderedDict()
+        )
+
+    def get(self, student_id: int, key: Hashable) -> Any:
+        """returns the cached value, or `MISSING` if there is no fresh entry"""
+        with self._lock:
+            student_entries = self._entries.get(student_id)
+            if student_entries is None:
+                return MISSING
+
+            expires_at, value = student_entries.get(key, (0, MISSING))
+            if expires_at < time.monotonic():
+                student_entries.pop(key, None)
+                return MISSING
+
+            self._entries.move_to_end(student_id)
+            return value
+
+    def set(
+        self,
+        student_id: int,
+        key: Hashable,
+        value: Any,
+        generation: Optional[int] = None,
+    ) -> None:
+        """caches the value, unless the cache was invalidated since `generation` was read"""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            student_entries = self._entries.setdefault(student_id, {})
+            student_entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(student_id)
+
+            while len(self._entries) > self.max_students:
+                self._entries.popitem(last=False)
+
+    def invalidate(
+        self, student_id: int, terms: Optional[Iterable[datetime]] = None
+    ) -> None:
+        """drops the student's entries whose window covers any of `terms`, or all of them if `terms` is None"""
+        with self._lock:
+            self.generation += 1
+            if terms is None:
+                self._entries.pop(student_id, None)
+                return
+
+            terms = list(terms)
+            student_entries = self._entries.get(student_id, {})
+            for window in [
+                window for window in student_entries if window_covers_any(window, terms)
+            ]:
+                del student_entries[window]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+class WindowCache:
+    """
+    TTL cache for responses that cover every student, keyed by date window
+
+    A window can hold several variants of a response (e.g. different sparse fieldsets), which are invalidated together
+    """
+
+    def __init__(self, ttl_seconds: float = 60, max_entries: int = 1_000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # bumped on every invalidation, so that values computed before an invalidation are not cached after it
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[DateWindow, Hashable], tuple[float, Any]] = (
+            OrderedDict()
+        )
+
+    def get(self, window: DateWindow, variant: Hashable = None) -> Any:
+        """returns the cached value, or `MISSING` if there is no fresh entry"""
+        with self._lock:
+            key = (window, variant)
+            expires_at, value = self._entries.get(key, (0, MISSING))
+            if expires_at < time.monotonic():
+                self._entries.pop(key, None)
+                return MISSING
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(
+        self,
+        window: DateWindow,
+        value: Any,
+        generation: Optional[int] = None,
+        variant: Hashable = None,
+    ) -> None:
+        """caches the value, unless the cache was invalidated since `generation` was read"""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            key = (window, variant)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, terms: Optional[Iterable[datetime]] = None) -> None:
+        """drops the entries whose window covers any of `terms`, or all of them if `terms` is None"""
+        with self._lock:
+            self.generation += 1
+            terms = None if terms is None else list(terms)
+            for key in [
+                key for key in self._entries if window_covers_any(key[0], terms)
+            ]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
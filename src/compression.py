@@ -0,0 +1,160 @@
+"""
+Response compression negotiated through the Accept-Encoding header
+
+Brotli is preferred when the client accepts it and the optional `brotli` package is installed, otherwise gzip is used
+Responses below `minimum_size` are sent as they are, and streamed responses are flushed chunk by chunk so that clients keep receiving bytes as soon as they are ready
+"""
+
+import zlib
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class GzipCompressor:
+    def __init__(self, level: int = 6):
+        # wbits=31 writes a gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, finish: bool) -> bytes:
+        flush_mode = zlib.Z_FINISH if finish else zlib.Z_SYNC_FLUSH
+        return self._compressor.compress(data) + self._compressor.flush(flush_mode)
+
+
+class BrotliCompressor:
+    def __init__(self, quality: int = 4):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, finish: bool) -> bytes:
+        compressed = self._compressor.process(data)
+        if finish:
+            return compressed + self._compressor.finish()
+        return compressed + self._compressor.flush()
+
+
+def supported_encodings() -> list[str]:
+    """encodings that the server can produce, most preferred first"""
+    if brotli is None:
+        return ["gzip"]
+    return ["br", "gzip"]
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Picks the encoding to use from an Accept-Encoding header
+
+    Returns:
+        The accepted encoding with the highest q-value, using server preference to break ties, or None if the client accepts none of them
+    """
+    accepted = {}
+    for part in accept_encoding.split(","):
+        encoding, _, params = part.strip().partition(";")
+        q_value = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q_value = float(params.strip()[2:])
+            except ValueError:
+                q_value = 0.0
+        accepted[encoding.strip().lower()] = q_value
+
+    candidates = [
+        (accepted.get(encoding, accepted.get("*", 0.0)), -preference, encoding)
+        for preference, encoding in enumerate(supported_encodings())
+    ]
+    q_value, _, encoding = max(candidates)
+    return encoding if q_value > 0 else None
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("Accept-Encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        if encoding == "br":
+            compressor = BrotliCompressor(self.brotli_quality)
+        else:
+            compressor = GzipCompressor(self.gzip_level)
+
+        responder = CompressionResponder(
+            self.app, encoding, compressor, self.minimum_size
+        )
+        await responder(scope, receive, send)
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: str, compressor, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.compressor = compressor
+        self.minimum_size = minimum_size
+        self.send: Send = None
+        self.initial_message: Message = {}
+        self.started = False
+        # whether the response is passed through without being compressed
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # hold back the headers until we know whether the body will be compressed
+            self.initial_message = message
+            self.passthrough = "content-encoding" in Headers(raw=message["headers"])
+            return
+
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if not self.started:
+            self.started = True
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+
+            if not self.passthrough:
+                message["body"] = self.compressor.compress(body, finish=not more_body)
+
+                headers = MutableHeaders(raw=self.initial_message["headers"])
+                headers["Content-Encoding"] = self.encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    # the length of a streamed response is not known up front
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(message["body"]))
+
+            await self.send(self.initial_message)
+            await self.send(message)
+            return
+
+        if not self.passthrough:
+            message["body"] = self.compressor.compress(body, finish=not more_body)
+        await self.send(message)
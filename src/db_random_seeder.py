@@ -5,11 +5,24 @@ from sqlalchemy.exc import SQLAlchemyError
 
 from DB import Teacher, Student, Course_Record, init_db
 from DB.Base import Base
+from DB.shards import replicate_teachers
 
 
 def randomly_seed_db():
     fake = Faker()
     init_db()
+
+    # teachers are written to the first shard and copied to the others
+    teacher_ids = randomly_seed_teachers(fake)
+    replicate_teachers()
+
+    # every shard gets its own students and course records
+    for shard in range(len(Base.engines)):
+        print(f"Seeding shard {shard}:")
+        randomly_seed_shard(fake, shard, teacher_ids)
+
+
+def randomly_seed_teachers(fake: Faker) -> list[int]:
     with Base.session_scope() as session:
         try:
             # create 2 fake teachers
@@ -26,7 +39,17 @@ def randomly_seed_db():
 
             print("Finished uploading teachers:")
             pprint(teachers)
+            return teacher_ids
+        except SQLAlchemyError as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
 
+
+def randomly_seed_shard(fake: Faker, shard: int, teacher_ids: list[int]):
+    with Base.session_scope(shard) as session:
+        try:
             # create 10 fake students
             students = []
             student_ids = []
@@ -0,0 +1,48 @@
+"""
+Serializers used to stream bulk exports
+
+Each serializer takes an iterator of row chunks and yields one encoded piece of the response body per chunk, so the full export is never held in memory
+"""
+
+import csv
+import io
+import json
+from typing import Iterable, Iterator
+from humps import camelize
+
+STUDENT_EXPORT_COLUMNS = [
+    "student_id",
+    "student_name",
+    "teacher_name",
+    "cumulative_gpa",
+]
+
+
+def to_csv(
+    chunks: Iterable[list[dict]], columns: list[str] = STUDENT_EXPORT_COLUMNS
+) -> Iterator[str]:
+    """yields the CSV header before reading any rows, so that the client receives it before the query has finished, then one block of rows per chunk"""
+    yield ",".join(camelize(column) for column in columns) + "\r\n"
+
+    for chunk in chunks:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+
+
+def to_ndjson(
+    chunks: Iterable[list[dict]], columns: list[str] = STUDENT_EXPORT_COLUMNS
+) -> Iterator[str]:
+    """yields one JSON object per line, with camelCase keys to match the JSON API. Nothing is sent until the first chunk of rows is ready"""
+    for chunk in chunks:
+        yield "".join(
+            json.dumps({camelize(column): row[column] for column in columns}) + "\n"
+            for row in chunk
+        )
+
+
+EXPORT_FORMATS = {
+    "csv": (to_csv, "text/csv"),
+    "ndjson": (to_ndjson, "application/x-ndjson"),
+}
@@ -0,0 +1,130 @@
+"""
+Incremental parsers for bulk uploads
+
+Uploads are read line by line from the request stream, so only the current line (and the batch being staged) is ever held in memory
+"""
+
+import csv
+import json
+from datetime import datetime
+from typing import AsyncIterator, Optional
+from humps import decamelize
+
+CourseRecordRow = tuple[int, datetime, Optional[float]]
+
+# range of the postgres integer type that student ids are stored as
+MIN_STUDENT_ID, MAX_STUDENT_ID = -(2**31), 2**31 - 1
+
+
+async def iter_lines(byte_chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    splits a stream of bytes into decoded lines, without waiting for the whole stream
+
+    Bytes that are not valid UTF-8 are replaced rather than raised, so that they only make their own line fail to parse instead of failing the whole upload
+    """
+    buffer = b""
+    async for chunk in byte_chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode(errors="replace").rstrip("\r")
+
+    if buffer:
+        yield buffer.decode(errors="replace").rstrip("\r")
+
+
+def parse_student_id(value) -> int:
+    """
+    Raises:
+        `ValueError`: if `value` is not an integer (or a string of digits) that fits in the student id column
+    """
+    # bools are ints too, and floats would be silently truncated
+    if isinstance(value, int) and not isinstance(value, bool):
+        student_id = value
+    elif isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        student_id = int(value.strip())
+    else:
+        raise ValueError(f"Invalid student id: {value!r}")
+
+    if not MIN_STUDENT_ID <= student_id <= MAX_STUDENT_ID:
+        raise ValueError(f"Student id is out of range: {student_id}")
+
+    return student_id
+
+
+def parse_course_record(record: dict) -> CourseRecordRow:
+    """
+    Converts a single uploaded record into a row for the course_record table
+
+    Args:
+        `record`: mapping with studentId / student_id, endDate / end_date (DD-MM-YYYY) and an optional grade
+
+    Returns:
+        (student_id, end_date, grade)
+
+    Raises:
+        `ValueError`: if any of the fields are missing or invalid
+    """
+    record = {decamelize(str(key)).strip(): value for key, value in record.items()}
+
+    try:
+        student_id = parse_student_id(record["student_id"])
+        end_date = datetime.strptime(str(record["end_date"]).strip(), "%d-%m-%Y")
+
+        grade = record.get("grade")
+        if grade is None or grade == "":
+            return student_id, end_date, None
+
+        grade = float(grade)
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Invalid course record: {record}") from e
+
+    # raw scores can only fall in between 0 and 100
+    if not 0 <= grade <= 100:
+        raise ValueError(f"Grade should be between 0 and 100, got {grade}")
+
+    return student_id, end_date, grade
+
+
+async def parse_csv(
+    lines: AsyncIterator[str],
+) -> AsyncIterator[Optional[CourseRecordRow]]:
+    """parses CSV with a header row, yielding None for every row that cannot be parsed"""
+    header = None
+    async for line in lines:
+        if not line.strip():
+            continue
+
+        values = next(csv.reader([line]))
+        if header is None:
+            header = values
+            continue
+
+        try:
+            yield parse_course_record(dict(zip(header, values)))
+        except ValueError:
+            yield None
+
+
+async def parse_ndjson(
+    lines: AsyncIterator[str],
+) -> AsyncIterator[Optional[CourseRecordRow]]:
+    """parses one JSON object per line, yielding None for every line that cannot be parsed"""
+    async for line in lines:
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError(f"Expected a JSON object, got {line}")
+            yield parse_course_record(record)
+        except ValueError:
+            yield None
+
+
+INGEST_FORMATS = {
+    "text/csv": parse_csv,
+    "application/x-ndjson": parse_ndjson,
+    "application/jsonl": parse_ndjson,
+}
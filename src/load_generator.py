@@ -0,0 +1,324 @@
+"""
+End-to-end load generator for the web service
+
+Drives the running service over HTTP with a weighted mix of requests, and writes a JSON report with throughput, error rates and latency percentiles, both overall and for every second of the run
+
+Example (against a local server, on a freshly seeded DB):
+    python load_generator.py --seed --rate 200 --duration 30 --mix students=60,students-window=20,change-teacher=10,ping=10 --output report.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import httpx
+
+# the seeder creates course records that end between 2021 and 2024
+SEEDED_DATE_RANGE = (datetime(2021, 1, 1), datetime(2025, 1, 1))
+
+
+@dataclass
+class Sample:
+    scenario: str
+    # seconds since the start of the run at which the request was due to be sent
+    scheduled_at: float
+    # seconds since the start of the run at which the response (or error) was received
+    completed_at: float
+    latency_ms: float
+    ok: bool
+
+
+@dataclass
+class LoadGenerator:
+    base_url: str
+    mix: dict[str, float]
+    student_ids: list[int]
+    teacher_ids: list[int]
+    samples: list[Sample] = field(default_factory=list)
+
+    def random_date(self) -> datetime:
+        start, end = SEEDED_DATE_RANGE
+        return start + timedelta(
+            seconds=random.uniform(0, (end - start).total_seconds())
+        )
+
+    def build_request(self, scenario: str) -> tuple[str, str, dict]:
+        """returns the method, path and keyword arguments for httpx for a single request of `scenario`"""
+        if scenario == "ping":
+            return "GET", "/ping", {}
+
+        if scenario == "students":
+            return "GET", "/students", {}
+
+        if scenario in ("students-window", "students-after", "students-before"):
+            start_date, end_date = sorted((self.random_date(), self.random_date()))
+            params = {}
+            if scenario != "students-before":
+                params["startDate"] = start_date.strftime("%d-%m-%Y")
+            if scenario != "students-after":
+                params["endDate"] = end_date.strftime("%d-%m-%Y")
+            return "GET", "/students", {"params": params}
+
+        if scenario == "change-teacher":
+            return (
+                "POST",
+                "/students/change-teacher",
+                {
+                    "json": {
+                        "studentId": random.choice(self.student_ids),
+                        "newTeacherId": random.choice(self.teacher_ids),
+                    }
+                },
+            )
+
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+    async def send(
+        self, client: httpx.AsyncClient, scenario: str, scheduled_at: float, t0: float
+    ) -> None:
+        method, path, kwargs = self.build_request(scenario)
+        try:
+            response = await client.request(method, path, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+
+        # latency is measured from when the request was due, not from when it was sent, so that queueing in the generator is not hidden
+        completed_at = time.perf_counter() - t0
+        latency_ms = (completed_at - scheduled_at) * 1000
+        self.samples.append(
+            Sample(scenario, scheduled_at, completed_at, latency_ms, ok)
+        )
+
+    def pick_scenario(self) -> str:
+        return random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+
+    async def run_open_loop(
+        self,
+        client: httpx.AsyncClient,
+        rate: float,
+        duration: float,
+        max_in_flight: int,
+    ) -> None:
+        """sends requests with Poisson arrivals at `rate` per second, whether or not earlier requests have completed"""
+        in_flight = asyncio.Semaphore(max_in_flight)
+        tasks = []
+        t0 = time.perf_counter()
+        scheduled_at = 0.0
+
+        async def send_when_allowed(scenario: str, scheduled_at: float) -> None:
+            async with in_flight:
+                await self.send(client, scenario, scheduled_at, t0)
+
+        while True:
+            scheduled_at += random.expovariate(rate)
+            if scheduled_at >= duration:
+                break
+
+            await asyncio.sleep(max(scheduled_at - (time.perf_counter() - t0), 0))
+            tasks.append(
+                asyncio.create_task(
+                    send_when_allowed(self.pick_scenario(), scheduled_at)
+                )
+            )
+
+        await asyncio.gather(*tasks)
+
+    async def run_closed_loop(
+        self, client: httpx.AsyncClient, concurrency: int, duration: float
+    ) -> None:
+        """keeps `concurrency` requests in flight, sending the next one as soon as the previous one completes"""
+        t0 = time.perf_counter()
+
+        async def worker() -> None:
+            while (scheduled_at := time.perf_counter() - t0) < duration:
+                await self.send(client, self.pick_scenario(), scheduled_at, t0)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def percentile(sorted_values: list[float], pct: float) -> Optional[float]:
+    """nearest-rank percentile"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def elapsed_seconds(samples: list[Sample], duration: float) -> float:
+    """time from the start of the run until the last response, which can be later than `duration` when the server falls behind"""
+    return max([duration, *(sample.completed_at for sample in samples)])
+
+
+def summarize(samples: list[Sample], elapsed: float) -> dict:
+    """
+    Args:
+        `samples`: the requests to summarize
+        `elapsed`: the time over which they completed, in seconds
+
+    Throughput only counts successful responses, so that it shows what the server achieved rather than the rate that requests were sent at
+    """
+    latencies = sorted(sample.latency_ms for sample in samples)
+    errors = sum(not sample.ok for sample in samples)
+
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": errors / len(samples) if samples else 0.0,
+        "throughput_rps": (len(samples) - errors) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+
+
+def build_report(
+    samples: list[Sample], duration: float, config: dict, interval: float = 1.0
+) -> dict:
+    scenarios = sorted({sample.scenario for sample in samples})
+    elapsed = elapsed_seconds(samples, duration)
+
+    # grouped by when requests completed, so that the timeline shows when the server actually served them
+    windows = [[] for _ in range(math.ceil(elapsed / interval))]
+    for sample in samples:
+        windows[min(int(sample.completed_at // interval), len(windows) - 1)].append(
+            sample
+        )
+    timeline = [
+        {"start_s": index * interval, **summarize(window, interval)}
+        for index, window in enumerate(windows)
+    ]
+
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "config": config,
+        "elapsed_s": elapsed,
+        "offered_rps": len(samples) / duration if duration else 0.0,
+        "summary": summarize(samples, elapsed),
+        "scenarios": {
+            scenario: summarize(
+                [sample for sample in samples if sample.scenario == scenario],
+                elapsed,
+            )
+            for scenario in scenarios
+        },
+        "timeline": timeline,
+    }
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    """parses a mix like `students=70,ping=30` into scenario weights"""
+    weights = {}
+    for part in mix.split(","):
+        scenario, _, weight = part.partition("=")
+        weights[scenario.strip()] = float(weight or 1)
+    return weights
+
+
+def parse_ids(ids: str) -> list[int]:
+    """parses ids like `1-10` or `1,2,5`"""
+    if "-" in ids:
+        first, last = ids.split("-")
+        return list(range(int(first), int(last) + 1))
+    return [int(id) for id in ids.split(",")]
+
+
+async def main(args: argparse.Namespace) -> dict:
+    generator = LoadGenerator(
+        base_url=args.url,
+        mix=parse_mix(args.mix),
+        student_ids=parse_ids(args.student_ids),
+        teacher_ids=parse_ids(args.teacher_ids),
+    )
+    for scenario in generator.mix:
+        generator.build_request(scenario)
+
+    limits = httpx.Limits(
+        max_connections=args.max_in_flight if args.rate else args.concurrency
+    )
+    async with httpx.AsyncClient(
+        base_url=args.url, limits=limits, timeout=args.timeout
+    ) as client:
+        if args.rate:
+            await generator.run_open_loop(
+                client, args.rate, args.duration, args.max_in_flight
+            )
+        else:
+            await generator.run_closed_loop(client, args.concurrency, args.duration)
+
+    config = {
+        "url": args.url,
+        "mode": "open" if args.rate else "closed",
+        "rate": args.rate,
+        "concurrency": None if args.rate else args.concurrency,
+        "duration_s": args.duration,
+        "mix": generator.mix,
+    }
+    return build_report(generator.samples, args.duration, config)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--url", default="http://localhost:3003")
+    parser.add_argument(
+        "--mix",
+        default="students=50,students-window=20,students-after=5,students-before=5,change-teacher=10,ping=10",
+        help="comma separated scenario=weight pairs. Scenarios: students, students-window, students-after, students-before, change-teacher, ping",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="open loop arrival rate in requests per second. If not set, runs closed loop with --concurrency",
+    )
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=500,
+        help="cap on concurrent requests in open loop mode",
+    )
+    parser.add_argument("--duration", type=float, default=30, help="in seconds")
+    parser.add_argument("--timeout", type=float, default=30, help="in seconds")
+    parser.add_argument("--student-ids", default="1-10")
+    parser.add_argument("--teacher-ids", default="1-2")
+    parser.add_argument(
+        "--seed",
+        action="store_true",
+        help="seed the local DB with random data before the run",
+    )
+    parser.add_argument("--output", default=None, help="file to write the report to")
+    args = parser.parse_args()
+
+    if args.seed:
+        from db_random_seeder import randomly_seed_db
+
+        randomly_seed_db()
+
+    report = asyncio.run(main(args))
+
+    if args.output:
+        with open(args.output, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+
+    print(
+        json.dumps(
+            {
+                "config": report["config"],
+                "elapsed_s": report["elapsed_s"],
+                "offered_rps": report["offered_rps"],
+                **report["summary"],
+            },
+            indent=2,
+        )
+    )
@@ -1,7 +1,9 @@
 from fastapi import FastAPI, status, Request, HTTPException, Depends, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
-from typing import Callable
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Callable, Optional, Literal
+from datetime import datetime
 from contextlib import asynccontextmanager
 from typing import Annotated
 import logging, os
@@ -14,10 +16,34 @@ from models.response_models import (
     InvalidParamsResponse,
     StudentDataListResponse,
     BadRequestResponse,
+    StudentData,
+    SingleFlightStatsResponse,
+    BulkCourseRecordResponse,
+    StudentGpaHistoryResponse,
+    SlowQueryLogResponse,
+    ArchivePartitionsResponse,
+    GpaWindowsResponse,
+    StudentChangesResponse,
+)
+from models.request_models import ChangeTeacherRequest, GpaWindowsRequest
+from validators import validate_date, validate_fields, validate_change_cursor
+from compression import CompressionMiddleware
+from single_flight import SingleFlight
+from cache import StudentCache, WindowCache, MISSING
+from export_formats import EXPORT_FORMATS
+from ingest import INGEST_FORMATS, iter_lines
+from DB import (
+    Base,
+    init_db,
+    ShardedStudentDB,
+    ShardedCourseRecordDB,
+    archive_course_record_partitions,
+    DBConnectionError,
+    DBAPIError,
+    DBRecordNotFoundError,
+    ChangeListener,
+    StudentChanges,
 )
-from models.request_models import ChangeTeacherRequest
-from validators import validate_date
-from DB import init_db, StudentDB, DBConnectionError, DBAPIError, DBRecordNotFoundError
 
 load_dotenv(find_dotenv())
 
@@ -44,12 +70,119 @@ async def lifespan(app: FastAPI):
         logging.critical("DB CONNECTION CANNOT BE ESTABLISHED")
         print("Trouble connecting to DB :(")
 
+    if app.state.db_connected:
+        change_listener.start()
+
     yield ()
 
+    change_listener.stop()
+
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MINIMUM_SIZE") or "1024"),
+)
+
+student_db = ShardedStudentDB()
+course_record_db = ShardedCourseRecordDB()
+student_query_flight = SingleFlight()
+# caches are kept correct by change notifications from every worker, so they can hold data for a long time
+student_cache = StudentCache(
+    ttl_seconds=float(os.getenv("STUDENT_CACHE_TTL_SECONDS") or "3600")
+)
+student_list_cache = WindowCache(
+    ttl_seconds=float(os.getenv("STUDENT_LIST_CACHE_TTL_SECONDS") or "3600")
+)
+
+
+def invalidate_cached_students(changes: StudentChanges) -> None:
+    """drops only the cached responses that the changed students and terms affect"""
+    for student_id, terms in changes.items():
+        student_cache.invalidate(student_id, terms)
+
+    changed_terms = set()
+    for terms in changes.values():
+        if terms is None:
+            # the change affects every window (e.g. a new teacher)
+            changed_terms = None
+            break
+        changed_terms.update(terms)
+    student_list_cache.invalidate(changed_terms)
+
+
+def clear_cached_students() -> None:
+    student_cache.clear()
+    student_list_cache.clear()
+
+
+change_listener = ChangeListener(
+    on_change=invalidate_cached_students, on_reconnect=clear_cached_students
+)
+
+# fields of StudentData that can be requested through a sparse fieldset
+STUDENT_DATA_RESPONSE_FIELDS = frozenset(StudentData.model_fields)
+
+# maximum number of changed students that a single change feed request returns from each shard
+MAX_CHANGE_FEED_LIMIT = int(os.getenv("MAX_CHANGE_FEED_LIMIT") or "10000")
+
+# number of uploaded course records that are upserted in a single transaction
+COURSE_RECORD_BATCH_SIZE = int(os.getenv("COURSE_RECORD_BATCH_SIZE") or "5000")
+
+
+def validate_date_range(
+    start_date: Optional[str], end_date: Optional[str]
+) -> tuple[Optional[datetime], Optional[datetime]]:
+    """parses the startDate and endDate query params, making sure that they are in order"""
+    start_date = validate_date(start_date)
+    end_date = validate_date(end_date)
+
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Start date should not come before the end date. startDate: {start_date}, endDate: {end_date}",
+        )
+
+    return start_date, end_date
+
+
+def query_student_data(
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    fields: Optional[frozenset[str]] = None,
+) -> list[StudentData]:
+    """picks the StudentDB query that matches the date filters and fields that were provided"""
+    if fields is not None:
+        return student_db.get_cumulative_gpa_and_teacher_name_fields(
+            fields, start_date, end_date
+        )
+
+    if start_date and end_date:
+        return student_db.get_all_cumulative_gpa_and_teacher_name_between(
+            start_date, end_date
+        )
+
+    elif start_date:
+        return student_db.get_all_cumulative_gpa_and_teacher_name_after(start_date)
+
+    elif end_date:
+        return student_db.get_all_cumulative_gpa_and_teacher_name_before(end_date)
 
-student_db = StudentDB()
+    return student_db.get_all_cumulative_gpa_and_teacher_name()
+
+
+def query_and_cache_student_data(
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    fields: Optional[frozenset[str]] = None,
+) -> list[StudentData]:
+    """runs the query and caches its result, unless a write invalidated the window while it was running"""
+    generation = student_list_cache.generation
+    student_data = query_student_data(start_date, end_date, fields)
+    student_list_cache.set(
+        (start_date, end_date), student_data, generation, variant=fields
+    )
+    return student_data
 
 
 def verify_db_connection(request: Request):
@@ -124,10 +257,74 @@ def pong(request: Request) -> PingResponse:
     }
 
 
+@app.get("/stats/single-flight", status_code=status.HTTP_200_OK)
+def get_single_flight_stats() -> SingleFlightStatsResponse:
+    """
+    Counters for request coalescing on /students, for this worker process
+
+    executed: number of queries that were actually run against the DB
+
+    coalesced: number of requests that shared the result of an identical query that was already running
+    """
+    return {"ok": True, **student_query_flight.stats}
+
+
+@app.get("/admin/slow-queries", status_code=status.HTTP_200_OK)
+def get_slow_queries() -> SlowQueryLogResponse:
+    """
+    The most recent DB statements handled by this worker process that took longer than the slow query threshold, most recent first
+
+    For a sampled fraction of them, the query plan is included, captured with EXPLAIN (ANALYZE, BUFFERS) for SELECTs and EXPLAIN for other statements
+    """
+    return {
+        "ok": True,
+        "threshold_ms": Base.slow_query_log.threshold_ms,
+        "explain_sample_rate": Base.slow_query_log.explain_sample_rate,
+        "slow_queries": Base.slow_query_log.entries,
+    }
+
+
+@app.post(
+    "/admin/course-records/archive",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(verify_db_connection)],
+)
+def archive_course_records(
+    before_academic_year: Annotated[
+        int,
+        Query(
+            alias="beforeAcademicYear",
+            description="Academic years that start before this year are archived, e.g. 2022 archives everything up till Aug 1 2022",
+        ),
+    ],
+) -> ArchivePartitionsResponse:
+    """
+    Detaches the course_record partitions of old academic years without blocking writes, and moves them into the archive schema
+
+    Archived course records are no longer considered in any GPA calculation, so every worker is told to drop its cached student data
+    """
+    # every shard has partitions with the same names, so each name is only listed once
+    archived_partitions = sorted(
+        {
+            partition
+            for shard in range(len(Base.engines))
+            for partition in archive_course_record_partitions(
+                before_academic_year, shard
+            )
+        }
+    )
+    # the other workers clear their caches when the archive notification reaches them
+    clear_cached_students()
+
+    return {"ok": True, "archived_partitions": archived_partitions}
+
+
 @app.get(
     "/students",
     status_code=status.HTTP_200_OK,
     dependencies=[Depends(verify_db_connection)],
+    # leaves out the fields that were not requested through a sparse fieldset
+    response_model_exclude_unset=True,
     responses={
         status.HTTP_200_OK: {
             "model": StudentDataListResponse,
@@ -139,7 +336,7 @@ def pong(request: Request) -> PingResponse:
         },
         status.HTTP_422_UNPROCESSABLE_ENTITY: {
             "model": InvalidParamsResponse,
-            "description": "Dates were not formatted in the DD-MM-YYYY style specified",
+            "description": "Dates were not formatted in the DD-MM-YYYY style specified, or fields contains a field that does not exist",
         },
     },
 )
@@ -152,6 +349,12 @@ def get_student_data(
         str,
         Query(alias="endDate", description="Format: DD-MM-YYYY"),
     ] = None,
+    fields: Annotated[
+        str,
+        Query(
+            description="Comma separated list of the fields to return, out of studentName, cumulativeGpa and teacherName"
+        ),
+    ] = None,
 ) -> StudentDataListResponse:
     """
     For all students in the DB, get back their name, cumulative GPA and teacher's name
@@ -164,6 +367,8 @@ def get_student_data(
 
         endDate: the latest record that you want to take into consideration
 
+        fields: only return these fields for each student, e.g. studentName,cumulativeGpa. Teacher names are only looked up when teacherName is requested
+
     Returns:
 
         If neither startDate nor endDate are provided, all student course records that will be considered
@@ -175,38 +380,247 @@ def get_student_data(
         If both startDate and endDate are provided, only course records that ended between the startDate and the endDate are considered
     """
     # ideally, this could have been a dependency, but I could not combine a dependency and a query, so this is in the route handling logic instead
-    start_date = validate_date(start_date)
-    end_date = validate_date(end_date)
-
-    if start_date and end_date and start_date > end_date:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Start date should not come before the end date. startDate: {start_date}, endDate: {end_date}",
+    start_date, end_date = validate_date_range(start_date, end_date)
+    fields = validate_fields(fields, STUDENT_DATA_RESPONSE_FIELDS)
+
+    window = (start_date, end_date)
+    student_data_response = student_list_cache.get(window, variant=fields)
+    if student_data_response is MISSING:
+        # identical requests that arrive while this query is running share its result instead of running it again
+        student_data_response = student_query_flight.do(
+            ("students", start_date, end_date, fields),
+            lambda: query_and_cache_student_data(start_date, end_date, fields),
         )
 
-    student_data_response = []
+    return {"ok": True, "student_data": student_data_response}
 
-    if start_date and end_date:
-        student_data_response = (
-            student_db.get_all_cumulative_gpa_and_teacher_name_between(
-                start_date, end_date
-            )
-        )
 
-    elif start_date:
-        student_data_response = (
-            student_db.get_all_cumulative_gpa_and_teacher_name_after(start_date)
+@app.get(
+    "/students/export",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(verify_db_connection)],
+    responses={
+        status.HTTP_200_OK: {
+            "content": {"text/csv": {}, "application/x-ndjson": {}},
+            "description": "Streams the id, name, cumulative GPA and teacher name of every student, ordered by student id",
+        },
+        status.HTTP_400_BAD_REQUEST: {
+            "model": BadRequestResponse,
+            "description": "Ordering of dates is incorrect",
+        },
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {
+            "model": InvalidParamsResponse,
+            "description": "Dates were not formatted in the DD-MM-YYYY style specified, or the format is not supported",
+        },
+    },
+)
+def export_student_data(
+    export_format: Annotated[
+        Literal["csv", "ndjson"],
+        Query(alias="format", description="Either csv or ndjson"),
+    ] = "csv",
+    start_date: Annotated[
+        str,
+        Query(alias="startDate", description="Format: DD-MM-YYYY"),
+    ] = None,
+    end_date: Annotated[
+        str,
+        Query(alias="endDate", description="Format: DD-MM-YYYY"),
+    ] = None,
+) -> StreamingResponse:
+    """
+    Streams the same student data as /students, for bulk exports
+
+    Rows are read from the DB in chunks and sent as soon as they are ready, so the export uses constant memory no matter how many students there are
+
+    The response starts before the query runs, so a CSV export sends its header straight away. Rows only follow once the DB has aggregated every student's GPA. If the query fails after the response has started, the response is cut off before its end instead of returning an error status, so clients should treat an incomplete response as a failed export
+
+    Args:
+
+        format: csv or ndjson
+
+        startDate: the earliest record that you want to take into consideration
+
+        endDate: the latest record that you want to take into consideration
+    """
+    start_date, end_date = validate_date_range(start_date, end_date)
+
+    chunks = student_db.stream_cumulative_gpa_and_teacher_name(start_date, end_date)
+
+    serializer, media_type = EXPORT_FORMATS[export_format]
+    return StreamingResponse(
+        serializer(chunks),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="students.{export_format}"'
+        },
+    )
+
+
+@app.get(
+    "/students/changes",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(verify_db_connection)],
+    responses={
+        status.HTTP_200_OK: {
+            "model": StudentChangesResponse,
+            "description": "Returns the students whose teacher or course records changed after the since cursor, in the order that they changed, along with the cursor to use on the next request",
+        },
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {
+            "model": InvalidParamsResponse,
+            "description": "since is not a cursor returned by a previous request, or limit is out of range",
+        },
+    },
+)
+def get_student_changes(
+    since: Annotated[
+        str,
+        Query(
+            description="The latestSeq returned by the previous request. Leave out to get every student"
+        ),
+    ] = None,
+    limit: Annotated[
+        int,
+        Query(
+            ge=1,
+            le=MAX_CHANGE_FEED_LIMIT,
+            description="Maximum number of changes to return from each shard",
+        ),
+    ] = 1000,
+) -> StudentChangesResponse:
+    """
+    For every student whose teacher or course records changed since the previous sync, get back their name, teacher and cumulative GPA
+
+    Every write to a student or their course records stamps the student with the next change sequence, so only the students that changed after the cursor are read, through the index on the change sequence
+
+    Args:
+
+        since: the latestSeq returned by the previous request
+
+        limit: the maximum number of changes to return from each shard. When hasMore is true, request again with the returned latestSeq to get the rest
+    """
+    since = validate_change_cursor(since, len(student_db.shards))
+
+    changes, latest_seqs, has_more = student_db.get_changes_since(since, limit)
+
+    return {
+        "ok": True,
+        "changes": changes,
+        "latest_seq": ".".join(str(seq) for seq in latest_seqs),
+        "has_more": has_more,
+    }
+
+
+# declared after the other /students/... GET routes, so that their paths are not captured as a student id
+@app.get(
+    "/students/{student_id}",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(verify_db_connection)],
+    responses={
+        status.HTTP_200_OK: {
+            "model": StudentGpaHistoryResponse,
+            "description": "Returns the student's teacher, cumulative GPA and GPA for each term. If a startDate and or endDate were provided, only terms from that period of time would be considered",
+        },
+        status.HTTP_400_BAD_REQUEST: {
+            "model": BadRequestResponse,
+            "description": "Ordering of dates is incorrect",
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "model": RecordNotFoundResponse,
+            "description": "raised when the requested student cannot be found",
+        },
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {
+            "model": InvalidParamsResponse,
+            "description": "Dates were not formatted in the DD-MM-YYYY style specified",
+        },
+    },
+)
+def get_single_student_data(
+    student_id: int,
+    start_date: Annotated[
+        str,
+        Query(alias="startDate", description="Format: DD-MM-YYYY"),
+    ] = None,
+    end_date: Annotated[
+        str,
+        Query(alias="endDate", description="Format: DD-MM-YYYY"),
+    ] = None,
+) -> StudentGpaHistoryResponse:
+    """
+    For a single student, get back their name, teacher's name, cumulative GPA and GPA history
+
+    The GPA history has one entry per term, with the GPA for that term and the running cumulative GPA up till that term
+
+    Args:
+
+        studentId: the id of the student
+
+        startDate: the earliest record that you want to take into consideration
+
+        endDate: the latest record that you want to take into consideration
+    """
+    start_date, end_date = validate_date_range(start_date, end_date)
+
+    cache_key = (start_date, end_date)
+    student_data = student_cache.get(student_id, cache_key)
+    if student_data is MISSING:
+        generation = student_cache.generation
+        student_data = student_db.get_student_gpa_history(
+            student_id, start_date, end_date
         )
+        student_cache.set(student_id, cache_key, student_data, generation)
 
-    elif end_date:
-        student_data_response = (
-            student_db.get_all_cumulative_gpa_and_teacher_name_before(end_date)
+    return {"ok": True, **student_data}
+
+
+@app.post(
+    "/students/gpa-windows",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(verify_db_connection)],
+    responses={
+        status.HTTP_200_OK: {
+            "model": GpaWindowsResponse,
+            "description": "Returns one row per student, with their cumulative GPA in each of the requested windows",
+        },
+        status.HTTP_400_BAD_REQUEST: {
+            "model": BadRequestResponse,
+            "description": "Ordering of dates in a window is incorrect, or window names are repeated",
+        },
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {
+            "model": InvalidParamsResponse,
+            "description": "Dates were not formatted in the DD-MM-YYYY style specified",
+        },
+    },
+)
+def get_student_gpa_windows(req_body: GpaWindowsRequest) -> GpaWindowsResponse:
+    """
+    For all students in the DB, get back their name, teacher's name and cumulative GPA within each of several named date windows, computed in a single pass over the course records
+
+    Body params:
+
+        windows: a list of windows, each with a name, and an optional startDate and endDate (Format: DD-MM-YYYY). A window without a startDate or endDate is unbounded on that side
+
+    Returns:
+
+        For each student with a course record in at least one window, windowGpas maps every window name to the student's cumulative GPA in that window, or null if they have no course records in it
+    """
+    names = [window.name for window in req_body.windows]
+    if len(set(names)) != len(names):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Window names should be unique. names: {names}",
         )
 
-    else:
-        student_data_response = student_db.get_all_cumulative_gpa_and_teacher_name()
+    windows = [
+        validate_date_range(window.start_date, window.end_date)
+        for window in req_body.windows
+    ]
 
-    return {"ok": True, "student_data": student_data_response}
+    student_data = student_db.get_cumulative_gpa_for_windows(windows)
+    for student in student_data:
+        student["window_gpas"] = dict(zip(names, student["window_gpas"]))
+
+    return {"ok": True, "student_data": student_data}
 
 
 @app.post(
@@ -244,12 +658,91 @@ def change_teacher_data(req_body: ChangeTeacherRequest) -> ChangeTeacherResponse
     updated_student = student_db.change_teacher(
         req_body.student_id, req_body.new_teacher_id
     )
+    # other workers are told about the change through a notification from the DB
+    invalidate_cached_students({req_body.student_id: None})
     updated_student["ok"] = True
 
     return updated_student
 
 
+@app.post(
+    "/course-records/bulk",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(verify_db_connection)],
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "text/csv": {"schema": {"type": "string"}},
+                "application/x-ndjson": {"schema": {"type": "string"}},
+            },
+            "required": True,
+        }
+    },
+    responses={
+        status.HTTP_200_OK: {
+            "model": BulkCourseRecordResponse,
+            "description": "Number of course records that were inserted, updated and rejected",
+        },
+        status.HTTP_415_UNSUPPORTED_MEDIA_TYPE: {
+            "model": BadRequestResponse,
+            "description": "Content-Type is neither text/csv nor application/x-ndjson",
+        },
+    },
+)
+async def bulk_upsert_course_records(request: Request) -> BulkCourseRecordResponse:
+    """
+    Inserts or updates course records from a streamed CSV or NDJSON upload, matching records on (studentId, endDate)
+
+    The upload is parsed as it arrives and upserted in batches, so it is never loaded into memory as a whole. Every batch is committed on its own, so if the upload fails halfway, the batches before it are kept
+
+    CSV uploads need a header row. Each record has:
+
+        studentId: the id of the student that the record belongs to
+
+        endDate: the end date of the course, formatted as DD-MM-YYYY
+
+        grade: the raw score of the student, between 0 and 100 (optional)
+
+    Records are rejected when they cannot be parsed, when their student does not exist, when their endDate falls outside the academic years from COURSE_RECORD_FIRST_ACADEMIC_YEAR up till next year, or when a later record in the same batch has the same studentId and endDate
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    parser = INGEST_FORMATS.get(content_type)
+    if parser is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Unsupported content type: {content_type}. Use one of {', '.join(INGEST_FORMATS)}",
+        )
+
+    counts = {"inserted": 0, "updated": 0, "rejected": 0}
+
+    async def upsert(batch: list) -> None:
+        batch_counts = await run_in_threadpool(course_record_db.upsert_batch, batch)
+        for key, value in batch_counts.items():
+            counts[key] += value
+
+        changed_terms = {}
+        for student_id, end_date, _ in batch:
+            changed_terms.setdefault(student_id, set()).add(end_date)
+        invalidate_cached_students(changed_terms)
+
+    batch = []
+    async for row in parser(iter_lines(request.stream())):
+        if row is None:
+            counts["rejected"] += 1
+            continue
+
+        batch.append(row)
+        if len(batch) >= COURSE_RECORD_BATCH_SIZE:
+            await upsert(batch)
+            batch = []
+
+    if batch:
+        await upsert(batch)
+
+    return {"ok": True, **counts}
+
+
 if __name__ == "__main__":
-    import uvicorn
+    from serve import serve
 
-    uvicorn.run(app, host="0.0.0.0", port=3003)
+    serve()
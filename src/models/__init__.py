@@ -1,4 +1,4 @@
-from models.request_models import ChangeTeacherRequest
+from models.request_models import ChangeTeacherRequest, GpaWindowsRequest
 from models.response_models import (
     StudentDataResponse,
     ChangeTeacherResponse,
@@ -6,4 +6,5 @@ from models.response_models import (
     RecordNotFoundResponse,
     InvalidParamsResponse,
     StudentDataListResponse,
+    StudentGpaHistoryResponse,
 )
@@ -1,5 +1,6 @@
 from humps import camelize, decamelize
-from pydantic import BaseModel, ConfigDict, model_validator
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from typing import Optional
 
 
 def to_snake(string: str) -> str:
@@ -24,3 +25,13 @@ class CamelRequest(BaseModel):
 class ChangeTeacherRequest(CamelRequest):
     student_id: int
     new_teacher_id: int
+
+
+class GpaWindow(CamelRequest):
+    name: str = Field(min_length=1)
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+
+
+class GpaWindowsRequest(CamelRequest):
+    windows: list[GpaWindow] = Field(min_length=1, max_length=50)
@@ -1,4 +1,6 @@
 from pydantic import BaseModel, ConfigDict
+from datetime import datetime
+from typing import Optional
 from humps import camelize
 
 
@@ -20,9 +22,10 @@ class PingResponse(ResponseModel):
 
 
 class StudentData(CamelResponse):
-    student_name: str
-    cumulative_gpa: float
-    teacher_name: str
+    # optional, because sparse fieldsets only return the fields that were requested
+    student_name: Optional[str] = None
+    cumulative_gpa: Optional[float] = None
+    teacher_name: Optional[str] = None
 
 
 class StudentDataResponse(ResponseModel, StudentData):
@@ -33,6 +36,49 @@ class StudentDataListResponse(ResponseModel):
     student_data: list[StudentData]
 
 
+class TermGpa(CamelResponse):
+    end_date: datetime
+    gpa: float
+    cumulative_gpa: float
+
+
+class StudentGpaHistoryResponse(ResponseModel):
+    student_id: int
+    student_name: str
+    teacher_name: str
+    cumulative_gpa: Optional[float]
+    gpa_history: list[TermGpa]
+
+
+class StudentWindowGpa(CamelResponse):
+    student_id: int
+    student_name: str
+    teacher_name: str
+    # window name -> cumulative GPA within that window
+    window_gpas: dict[str, Optional[float]]
+
+
+class GpaWindowsResponse(ResponseModel):
+    student_data: list[StudentWindowGpa]
+
+
+class StudentChange(CamelResponse):
+    student_id: int
+    student_name: str
+    teacher_id: int
+    teacher_name: str
+    cumulative_gpa: Optional[float]
+    change_seq: int
+
+
+class StudentChangesResponse(ResponseModel):
+    changes: list[StudentChange]
+    # cursor to pass as `since` on the next request
+    latest_seq: str
+    # whether there are more changes after latest_seq
+    has_more: bool
+
+
 class ChangeTeacherResponse(ResponseModel):
     student_id: int
     student_name: str
@@ -40,6 +86,36 @@ class ChangeTeacherResponse(ResponseModel):
     updated_teacher_name: str
 
 
+class BulkCourseRecordResponse(ResponseModel):
+    inserted: int
+    updated: int
+    rejected: int
+
+
+class SingleFlightStatsResponse(ResponseModel):
+    executed: int
+    coalesced: int
+
+
+class SlowQuery(CamelResponse):
+    logged_at: datetime
+    statement: str
+    params: str
+    duration_ms: float
+    row_count: int
+    plan: Optional[list[str]]
+
+
+class SlowQueryLogResponse(ResponseModel):
+    threshold_ms: float
+    explain_sample_rate: float
+    slow_queries: list[SlowQuery]
+
+
+class ArchivePartitionsResponse(ResponseModel):
+    archived_partitions: list[str]
+
+
 class InvalidParamsResponse(ResponseModel):
     detail: str
     params: str
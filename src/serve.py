@@ -0,0 +1,28 @@
+"""
+Production entry point for the web service
+
+Runs the app with `WEB_CONCURRENCY` worker processes so that GPA aggregation and response serialization are spread across cores
+Each worker builds its own DB connection pool, sized from `DB_CONNECTION_BUDGET` (see `DB.Base`)
+"""
+
+import os
+import uvicorn
+from dotenv import load_dotenv, find_dotenv
+
+from DB.Base import get_worker_count
+
+load_dotenv(find_dotenv())
+
+
+def serve() -> None:
+    # the app has to be passed as an import string, so that every worker process can import it on its own
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST") or "0.0.0.0",
+        port=int(os.getenv("PORT") or "3003"),
+        workers=get_worker_count(),
+    )
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,139 @@
+"""
+Request coalescing for identical, concurrent, read-only queries
+
+The first caller for a key (the leader) runs the query, while every caller that arrives before it finishes (a follower) waits for and shares the leader's result
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    """an in-flight call that followers on other threads can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class _AsyncCall:
+    """an in-flight call that callers on the same event loop can await"""
+
+    def __init__(self):
+        self.task: asyncio.Task = None
+        # callers that are still waiting on the task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share the same key into a single execution"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+        self._async_calls: dict[Hashable, _AsyncCall] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """
+        Run `fn` once for all threads that call this with the same `key` at the same time
+
+        Args:
+            `key`: normalized parameters that identify the query
+            `fn`: function that runs the query
+
+        Returns:
+            The result of `fn`, shared between the leader and its followers
+
+        Raises:
+            Whatever exception the leader's call to `fn` raised
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+
+        except BaseException as e:
+            call.error = e
+            raise
+
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Async counterpart of `do`, for callers that share an event loop
+
+        `fn` runs in its own task, which belongs to no single caller, so cancelling any caller (e.g. because its client disconnected) leaves the others waiting on the result. The task is only cancelled once every caller waiting on it has been cancelled
+
+        Args:
+            `key`: normalized parameters that identify the query
+            `fn`: coroutine function that runs the query
+
+        Returns:
+            The result of `fn`, shared between every caller
+
+        Raises:
+            Whatever exception `fn` raised
+        """
+        call = self._async_calls.get(key)
+        if call is None:
+            call = _AsyncCall()
+            call.task = asyncio.ensure_future(self._run_async_call(key, call, fn))
+            self._async_calls[key] = call
+            with self._lock:
+                self.executed += 1
+        else:
+            with self._lock:
+                self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            # shield, so that this caller being cancelled does not cancel the shared task
+            return await asyncio.shield(call.task)
+
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # nobody is left to use the result. Later callers start a new call instead of joining the cancelled one
+                self._forget_async_call(key, call)
+                call.task.cancel()
+
+    async def _run_async_call(
+        self, key: Hashable, call: "_AsyncCall", fn: Callable[[], Awaitable[T]]
+    ) -> T:
+        try:
+            return await fn()
+        finally:
+            self._forget_async_call(key, call)
+
+    def _forget_async_call(self, key: Hashable, call: "_AsyncCall") -> None:
+        if self._async_calls.get(key) is call:
+            del self._async_calls[key]
+
+    @property
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"executed": self.executed, "coalesced": self.coalesced}
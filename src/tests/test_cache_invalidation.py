@@ -0,0 +1,92 @@
+from datetime import datetime
+
+import pytest
+
+import main
+from DB.change_notifications import (
+    CLEAR_ALL_PAYLOAD,
+    STUDENT_CHANGES_CHANNEL,
+    ChangeListener,
+    notify_all_students_changed,
+)
+
+TERM_2023 = datetime(2023, 4, 1)
+TERM_2024 = datetime(2024, 4, 1)
+WINDOW_2023 = (datetime(2023, 1, 1), datetime(2023, 12, 31))
+WINDOW_2024 = (datetime(2024, 1, 1), datetime(2024, 12, 31))
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    main.clear_cached_students()
+    yield
+    main.clear_cached_students()
+
+
+def test_clear_cached_students_empties_both_caches():
+    main.student_cache.set(1, WINDOW_2023, {"student_name": "a"})
+    main.student_list_cache.set(WINDOW_2023, ["a"])
+
+    main.clear_cached_students()
+
+    assert main.student_cache.get(1, WINDOW_2023) is main.MISSING
+    assert main.student_list_cache.get(WINDOW_2023) is main.MISSING
+
+
+def test_invalidate_cached_students_only_drops_affected_windows():
+    main.student_cache.set(1, WINDOW_2023, {"student_name": "a"})
+    main.student_cache.set(1, WINDOW_2024, {"student_name": "a"})
+    main.student_cache.set(2, WINDOW_2023, {"student_name": "b"})
+    main.student_list_cache.set(WINDOW_2023, ["a", "b"])
+    main.student_list_cache.set(WINDOW_2024, ["a", "b"])
+
+    main.invalidate_cached_students({1: {TERM_2024}})
+
+    assert main.student_cache.get(1, WINDOW_2023) is not main.MISSING
+    assert main.student_cache.get(1, WINDOW_2024) is main.MISSING
+    assert main.student_cache.get(2, WINDOW_2023) is not main.MISSING
+    assert main.student_list_cache.get(WINDOW_2023) is not main.MISSING
+    assert main.student_list_cache.get(WINDOW_2024) is main.MISSING
+
+
+def test_invalidate_cached_students_without_terms_drops_every_window():
+    main.student_cache.set(1, WINDOW_2023, {"student_name": "a"})
+    main.student_list_cache.set(WINDOW_2023, ["a"])
+    main.student_list_cache.set(WINDOW_2024, ["a"])
+
+    main.invalidate_cached_students({1: None})
+
+    assert main.student_cache.get(1, WINDOW_2023) is main.MISSING
+    assert main.student_list_cache.get(WINDOW_2023) is main.MISSING
+    assert main.student_list_cache.get(WINDOW_2024) is main.MISSING
+
+
+def test_change_listener_survives_failing_callbacks():
+    def fail(*args):
+        raise RuntimeError("boom")
+
+    listener = ChangeListener(on_change=fail, on_reconnect=fail)
+
+    listener._run_callback(listener.on_reconnect)
+    listener._handle('{"changes": [{"student_id": 1, "terms": null}]}')
+
+
+def test_change_listener_clears_everything_on_clear_all_messages():
+    cleared = []
+    listener = ChangeListener(
+        on_change=lambda changes: None, on_reconnect=lambda: cleared.append(True)
+    )
+
+    listener._handle(CLEAR_ALL_PAYLOAD)
+
+    assert cleared == [True]
+
+
+def test_notify_all_students_changed_publishes_clear_all():
+    executed = []
+
+    notify_all_students_changed(lambda *args: executed.append(args))
+
+    assert executed == [
+        ("SELECT pg_notify(%s, %s)", (STUDENT_CHANGES_CHANNEL, CLEAR_ALL_PAYLOAD))
+    ]
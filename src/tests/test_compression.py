@@ -0,0 +1,151 @@
+import gzip
+
+import pytest
+from fastapi import HTTPException
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import compression
+from compression import CompressionMiddleware, negotiate_encoding
+from validators import validate_fields
+
+LARGE_BODY = "x" * 2000
+
+
+@pytest.fixture
+def without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+
+
+requires_brotli = pytest.mark.skipif(
+    compression.brotli is None, reason="brotli is not installed"
+)
+
+
+@requires_brotli
+def test_negotiate_encoding_prefers_brotli_on_ties():
+    assert negotiate_encoding("gzip, br") == "br"
+
+
+def test_negotiate_encoding_uses_q_values():
+    assert negotiate_encoding("br;q=0.5, gzip;q=0.8") == "gzip"
+
+
+def test_negotiate_encoding_skips_q_0():
+    assert negotiate_encoding("br;q=0, gzip") == "gzip"
+    assert negotiate_encoding("gzip;q=0") is None
+
+
+@requires_brotli
+def test_negotiate_encoding_wildcard():
+    assert negotiate_encoding("*") == "br"
+    assert negotiate_encoding("br;q=0, *;q=0.5") == "gzip"
+    assert negotiate_encoding("*;q=0") is None
+
+
+def test_negotiate_encoding_without_accepted_encodings():
+    assert negotiate_encoding("") is None
+    assert negotiate_encoding("identity") is None
+
+
+def test_negotiate_encoding_without_brotli(without_brotli):
+    assert negotiate_encoding("br, gzip") == "gzip"
+    assert negotiate_encoding("br") is None
+
+
+def build_client() -> TestClient:
+    async def large(request):
+        return PlainTextResponse(LARGE_BODY)
+
+    async def small(request):
+        return PlainTextResponse("small")
+
+    async def streamed(request):
+        def chunks():
+            yield "a" * 100
+            yield "b" * 100
+
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    async def already_encoded(request):
+        return Response(
+            gzip.compress(LARGE_BODY.encode()),
+            headers={"Content-Encoding": "gzip"},
+            media_type="text/plain",
+        )
+
+    app = Starlette(
+        routes=[
+            Route("/large", large),
+            Route("/small", small),
+            Route("/streamed", streamed),
+            Route("/already-encoded", already_encoded),
+        ]
+    )
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+    return TestClient(app)
+
+
+def test_compresses_large_responses(without_brotli):
+    response = build_client().get("/large", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.text == LARGE_BODY
+
+
+@requires_brotli
+def test_compresses_with_brotli_when_preferred():
+    response = build_client().get("/large", headers={"Accept-Encoding": "br"})
+
+    assert response.headers["content-encoding"] == "br"
+    assert response.text == LARGE_BODY
+
+
+def test_small_responses_are_not_compressed():
+    response = build_client().get("/small", headers={"Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in response.headers
+    assert response.text == "small"
+
+
+def test_responses_are_not_compressed_without_accepted_encodings():
+    response = build_client().get("/large", headers={"Accept-Encoding": "identity"})
+
+    assert "content-encoding" not in response.headers
+    assert response.text == LARGE_BODY
+
+
+def test_streamed_responses_are_compressed_without_content_length(without_brotli):
+    response = build_client().get("/streamed", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.text == "a" * 100 + "b" * 100
+
+
+def test_already_encoded_responses_are_passed_through():
+    response = build_client().get("/already-encoded", headers={"Accept-Encoding": "br"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == LARGE_BODY
+
+
+def test_validate_fields():
+    allowed = ("student_name", "cumulative_gpa", "teacher_name")
+
+    assert validate_fields(None, allowed) is None
+    assert validate_fields("studentName, cumulativeGpa", allowed) == {
+        "student_name",
+        "cumulative_gpa",
+    }
+
+
+@pytest.mark.parametrize("fields", ["", ",", "studentName,unknownField"])
+def test_validate_fields_rejects_empty_and_unknown_fields(fields):
+    with pytest.raises(HTTPException) as error:
+        validate_fields(fields, ("student_name", "cumulative_gpa"))
+
+    assert error.value.status_code == 422
@@ -0,0 +1,16 @@
+from DB.Base import get_pool_size
+
+
+def test_pool_leaves_room_for_the_listener_connection(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    monkeypatch.setenv("DB_CONNECTION_BUDGET", "20")
+
+    # 4 workers * (4 pooled + 1 listener) connections = 20
+    assert get_pool_size() == 4
+
+
+def test_pool_keeps_at_least_one_connection(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    monkeypatch.setenv("DB_CONNECTION_BUDGET", "4")
+
+    assert get_pool_size() == 1
@@ -0,0 +1,61 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from ingest import iter_lines, parse_course_record, parse_ndjson
+
+
+async def collect(rows) -> list:
+    return [row async for row in rows]
+
+
+async def as_lines(lines: list[str]):
+    for line in lines:
+        yield line
+
+
+def test_parse_course_record():
+    assert parse_course_record(
+        {"studentId": "12", "endDate": "01-04-2024", "grade": "75.5"}
+    ) == (12, datetime(2024, 4, 1), 75.5)
+
+
+@pytest.mark.parametrize(
+    "record",
+    [
+        {"studentId": 1, "endDate": "01-04-2024", "grade": {}},
+        {"studentId": 1.9, "endDate": "01-04-2024", "grade": 50},
+        {"studentId": "1.9", "endDate": "01-04-2024", "grade": 50},
+        {"studentId": True, "endDate": "01-04-2024", "grade": 50},
+        {"studentId": 2**31, "endDate": "01-04-2024", "grade": 50},
+        {"studentId": 1, "endDate": "01-04-2024", "grade": 101},
+        {"endDate": "01-04-2024", "grade": 50},
+    ],
+)
+def test_parse_course_record_rejects_invalid_records(record):
+    with pytest.raises(ValueError):
+        parse_course_record(record)
+
+
+def test_parse_ndjson_rejects_malformed_rows_without_failing():
+    lines = [
+        '{"studentId": 1, "endDate": "01-04-2024", "grade": {}}',
+        "[1, 2]",
+        "not json",
+        '{"studentId": 1, "endDate": "01-04-2024", "grade": 80}',
+    ]
+
+    rows = asyncio.run(collect(parse_ndjson(as_lines(lines))))
+
+    assert rows == [None, None, None, (1, datetime(2024, 4, 1), 80.0)]
+
+
+def test_invalid_utf8_only_rejects_its_own_row():
+    async def byte_chunks():
+        yield b'{"studentId": 1, "endDate": "01-04-\xff2024", "grade": 80}\n'
+        yield b'{"studentId": 2, "endDate": "01-04-2024", "grade": 80}\n'
+
+    rows = asyncio.run(collect(parse_ndjson(iter_lines(byte_chunks()))))
+
+    assert rows == [None, (2, datetime(2024, 4, 1), 80.0)]
@@ -0,0 +1,31 @@
+from load_generator import Sample, build_report, percentile
+
+
+def test_percentile_uses_nearest_rank():
+    ten = [float(value) for value in range(1, 11)]
+    hundred = [float(value) for value in range(1, 101)]
+
+    assert percentile(ten, 50) == 5
+    assert percentile(ten, 90) == 9
+    assert percentile(hundred, 99) == 99
+    assert percentile(hundred, 100) == 100
+    assert percentile(hundred, 0) == 1
+    assert percentile([], 50) is None
+
+
+def test_report_measures_completions_not_arrivals():
+    # 4 requests sent in the first second, completing over 4 seconds, one of them failing
+    samples = [
+        Sample("ping", 0.1, 0.5, 400, True),
+        Sample("ping", 0.2, 1.5, 1300, True),
+        Sample("ping", 0.3, 2.5, 2200, False),
+        Sample("ping", 0.4, 4.0, 3600, True),
+    ]
+
+    report = build_report(samples, duration=1, config={})
+
+    assert report["elapsed_s"] == 4.0
+    assert report["offered_rps"] == 4
+    assert report["summary"]["throughput_rps"] == 3 / 4
+    assert [window["requests"] for window in report["timeline"]] == [1, 1, 1, 1]
+    assert [window["throughput_rps"] for window in report["timeline"]] == [1, 1, 0, 1]
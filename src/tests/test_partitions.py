@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from DB.partitions import (
+    academic_year_of,
+    is_in_partition_year_range,
+    is_missing_partition_error,
+)
+
+
+class FakePgError(Exception):
+    def __init__(self, pgcode: str, message: str):
+        super().__init__(message)
+        self.pgcode = pgcode
+
+
+def test_academic_year_starts_on_aug_1():
+    assert academic_year_of(datetime(2023, 7, 31)) == 2022
+    assert academic_year_of(datetime(2023, 8, 1)) == 2023
+
+
+def test_is_missing_partition_error():
+    assert is_missing_partition_error(
+        FakePgError("23514", 'no partition of relation "course_record" found for row')
+    )
+    assert not is_missing_partition_error(
+        FakePgError("23514", 'new row violates check constraint "grade_check"')
+    )
+    assert not is_missing_partition_error(ValueError("no partition"))
+
+
+def test_partition_year_range(monkeypatch):
+    monkeypatch.setenv("COURSE_RECORD_FIRST_ACADEMIC_YEAR", "2020")
+    next_academic_year = academic_year_of(datetime.now()) + 1
+
+    assert is_in_partition_year_range(datetime(2020, 8, 1))
+    assert is_in_partition_year_range(datetime(next_academic_year + 1, 7, 31))
+    assert not is_in_partition_year_range(datetime(2020, 7, 31))
+    assert not is_in_partition_year_range(datetime(2204, 4, 1))
+    assert not is_in_partition_year_range(datetime(1, 1, 1))
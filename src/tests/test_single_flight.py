@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_do_async_shares_one_execution():
+    flight = SingleFlight()
+    calls = 0
+
+    async def query():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def run():
+        return await asyncio.gather(*(flight.do_async("key", query) for _ in range(5)))
+
+    assert asyncio.run(run()) == [1] * 5
+    assert flight.stats == {"executed": 1, "coalesced": 4}
+
+
+def test_do_async_leader_cancellation_does_not_cancel_followers():
+    flight = SingleFlight()
+
+    async def query():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run():
+        leader = asyncio.create_task(flight.do_async("key", query))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do_async("key", query))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "result"
+
+
+def test_do_async_cancels_the_query_once_every_caller_is_cancelled():
+    flight = SingleFlight()
+
+    async def query():
+        await asyncio.sleep(1)
+        return "stale"
+
+    async def fast_query():
+        return "fresh"
+
+    async def run():
+        caller = asyncio.create_task(flight.do_async("key", query))
+        await asyncio.sleep(0)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+
+        # a new caller starts a new call instead of joining the cancelled one
+        return await flight.do_async("key", fast_query)
+
+    assert asyncio.run(run()) == "fresh"
+    assert flight.stats == {"executed": 2, "coalesced": 0}
+
+
+def test_do_async_shares_errors():
+    flight = SingleFlight()
+
+    async def query():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def run():
+        return await asyncio.gather(
+            *(flight.do_async("key", query) for _ in range(3)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def run_in_threads(flight: SingleFlight, fn, count: int) -> list:
+    """calls `flight.do` from `count` threads at once, returning each thread's result or exception"""
+    results = [None] * count
+
+    def call(index: int) -> None:
+        try:
+            results[index] = flight.do("key", fn)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    return results
+
+
+def wait_until_followers_join(flight: SingleFlight, followers: int) -> None:
+    deadline = time.monotonic() + 5
+    while flight.stats["coalesced"] < followers and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def test_do_shares_one_execution_between_threads():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = 0
+
+    def query():
+        nonlocal calls
+        calls += 1
+        # hold the leader until every follower is waiting on it
+        release.wait(timeout=5)
+        return "result"
+
+    releaser = threading.Thread(
+        target=lambda: (wait_until_followers_join(flight, 4), release.set())
+    )
+    releaser.start()
+    results = run_in_threads(flight, query, 5)
+    releaser.join()
+
+    assert results == ["result"] * 5
+    assert calls == 1
+    assert flight.stats == {"executed": 1, "coalesced": 4}
+
+
+def test_do_shares_errors_with_followers_and_forgets_the_key():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing_query():
+        release.wait(timeout=5)
+        raise ValueError("boom")
+
+    releaser = threading.Thread(
+        target=lambda: (wait_until_followers_join(flight, 2), release.set())
+    )
+    releaser.start()
+    results = run_in_threads(flight, failing_query, 3)
+    releaser.join()
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.stats == {"executed": 1, "coalesced": 2}
+
+    # the failed call is not reused, so the next caller runs the query again
+    assert flight.do("key", lambda: "retried") == "retried"
+    assert flight.stats == {"executed": 2, "coalesced": 2}
@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from DB.slow_query_log import SlowQueryLog
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    yield engine
+    engine.dispose()
+
+
+def test_logs_statements_over_the_threshold(engine):
+    slow_query_log = SlowQueryLog(threshold_ms=0, explain_sample_rate=0)
+    slow_query_log.attach(engine)
+
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+    [entry] = slow_query_log.entries
+    assert entry["statement"] == "SELECT 1"
+    assert entry["plan"] is None
+
+
+def test_failed_statements_do_not_break_later_timings(engine):
+    slow_query_log = SlowQueryLog(threshold_ms=10_000, explain_sample_rate=0)
+    slow_query_log.attach(engine)
+
+    with engine.connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.execute(text("SELECT * FROM missing_table"))
+        connection.execute(text("SELECT 1"))
+
+    assert slow_query_log.entries == []
+
+
+def test_explain_never_keeps_writes(engine):
+    slow_query_log = SlowQueryLog(threshold_ms=0, explain_sample_rate=1)
+
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE t (id int)"))
+
+    slow_query_log.attach(engine)
+    with engine.begin() as connection:
+        connection.execute(text("WITH x AS (SELECT 1) INSERT INTO t SELECT * FROM x"))
+
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM t")).scalar() == 1
@@ -5,8 +5,9 @@ In my opinion, validators difffers from models:
 """
 
 from datetime import datetime
-from typing import Optional
+from typing import Collection, Optional
 from fastapi import HTTPException, status
+from humps import decamelize
 
 
 def validate_date(date_string: Optional[str] = None) -> Optional[datetime]:
@@ -38,3 +39,75 @@ def validate_date(date_string: Optional[str] = None) -> Optional[datetime]:
             status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail=f"Invalid date: {date_string}. Format should be DD-MM-YYYY",
         )
+
+
+def validate_fields(
+    fields_string: Optional[str], allowed_fields: Collection[str]
+) -> Optional[frozenset[str]]:
+    """
+    Parses a comma separated list of camelCase field names, for sparse fieldsets
+
+    Args:
+        fields_string: the string passed in as a query parameter
+        allowed_fields: the snake_case names of the fields that can be requested
+
+    Returns:
+
+        If there was a fields parameter, the snake_case names of the requested fields
+
+        If there was no fields parameter, None
+
+    Raises:
+
+        HTTPException: if a field cannot be requested, or no fields were requested
+    """
+    if fields_string is None:
+        return None
+
+    fields = frozenset(
+        decamelize(field.strip()) for field in fields_string.split(",") if field.strip()
+    )
+    invalid_fields = fields - set(allowed_fields)
+
+    if not fields or invalid_fields:
+        raise HTTPException(
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Invalid fields: {fields_string}. Fields should be a comma separated list of {', '.join(sorted(allowed_fields))}",
+        )
+
+    return fields
+
+
+def validate_change_cursor(cursor_string: Optional[str], shard_count: int) -> list[int]:
+    """
+    Parses a change feed cursor, which holds the latest change sequence seen on each shard, separated by dots (e.g. 120.87)
+
+    Args:
+        cursor_string: the string passed in as a query parameter
+        shard_count: the number of shards, which must match the number of sequences in the cursor
+
+    Returns:
+
+        If there was a cursor parameter, the change sequence of each shard
+
+        If there was no cursor parameter, a change sequence of 0 for each shard, so that every student is returned
+
+    Raises:
+
+        HTTPException: if the cursor is not formatted properly
+    """
+    if not cursor_string:
+        return [0] * shard_count
+
+    try:
+        cursor = [int(seq) for seq in cursor_string.split(".")]
+    except ValueError:
+        cursor = []
+
+    if len(cursor) != shard_count or any(seq < 0 for seq in cursor):
+        raise HTTPException(
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Invalid cursor: {cursor_string}. Cursor should be the latestSeq returned by a previous request",
+        )
+
+    return cursor